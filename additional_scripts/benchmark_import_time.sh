@@ -0,0 +1,18 @@
+#!/bin/bash
+
+#startup latency of main.py and its modules - run from repository root
+#usage: bash additional_scripts/benchmark_import_time.sh [number of runs]
+runs=${1:-5}
+for module in modules.config modules.input_parsing modules.preprocessing modules.modeling modules.pipeline main; do
+    total=0
+    for i in $(seq "$runs"); do
+        us=$(python -X importtime -c "import $module" 2>&1 | tail -1 | awk -F'|' '{gsub(/ /, "", $2); print $2}')
+        total=$((total + us))
+    done
+    echo "$module: $((total / runs / 1000)) ms (cumulative import time, mean of $runs runs)"
+done
+
+#slowest imports pulled in by main.py
+python -X importtime -c "import main" 2>&1 | sort -t'|' -k2 -n | tail -15
+
+time python main.py --help > /dev/null
@@ -0,0 +1,33 @@
+'''
+Compares nltk and spaCy tokenizer backends on pages extracted from pdf files.
+Usage (from repository root): python additional_scripts/benchmark_tokenizers.py <folder with pdf files> [repeats]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.input_parsing import TextParser as tp
+from modules.preprocessing import PreProcessor as pp, TokenizerBackend
+
+
+def benchmark(documents:list, tokenizer:str, repeats:int=3) -> dict:
+    '''Returns best wall time of clear_text_case_punct over all documents and number of produced tokens.'''
+    TokenizerBackend.warm_up(tokenizer)
+    timings, num_tokens = [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        num_tokens = sum(len(tokens) for doc in documents for tokens in pp.clear_text_case_punct(dict(doc), tokenizer=tokenizer).values())
+        timings.append(time.perf_counter() - start)
+    return {'seconds':min(timings), 'tokens':num_tokens}
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    documents = [doc['text'] for doc in tp.pdf_generator(folder) if doc['text']]
+    num_pages = sum(len(doc) for doc in documents)
+    print(f'{len(documents)} documents, {num_pages} pages')
+    for tokenizer in TokenizerBackend.SUPPORTED:
+        result = benchmark(documents, tokenizer, repeats)
+        print(f"{tokenizer}: {result['seconds']:.3f} s, {num_pages / result['seconds']:.1f} pages/s, {result['tokens']} tokens")
@@ -1,4 +1,5 @@
 #!/bin/bash
 
-time seq 1 10 | parallel ./generate_nlp_set.sh {}
-time seq 1 10 | parallel ./generate_bioit_set.sh {}
\ No newline at end of file
+#text is extracted and cleaned once per dataset, files for all n-gram lengths are generated in a single run
+time python main.py --l 'My Library' --o "./Data/nlp_set/" --c 'NLP set' --m "nlp_set" --sm --ng 1-10 --ul --tfp
+time python main.py --l "My Library" --o "./Data/bioit_set/" --c "Bioinformatics set" --m "bioit_set" --sm --ng 1-10 --ul --tfp
@@ -1,12 +1,15 @@
 import os
 import warnings
-import matplotlib
+
+from glob import glob
 
 from modules.input_parsing import CMDInterface as cmdi, ExternalLibConnector as elc, LocalLibConnector as llc, TextParser as tp
-from modules.config import argument_dict, API_KEY, LIB_ID, stemming_algorithm, extended_stopword_list, tokenizer_alg, cooc_window_size, upper_freq_th, lower_freq_th
-from modules.preprocessing import PreProcessor as pp
-from modules.modeling import LatentDirichletAllocation as lda
-warnings.filterwarnings("ignore", category=matplotlib.MatplotlibDeprecationWarning)
+from modules.config import argument_dict, get_api_key, LIB_ID, stemming_algorithm, extended_stopword_list, tokenizer_alg, cooc_window_size, upper_freq_th, lower_freq_th, freq_filter_scope, extraction_workers, extraction_timeout, ordered_extraction, TOKEN_CACHE_PATH, token_cache_max_size_mb, token_cache_max_age_days, cooc_engine, pipeline_queue_size, local_copy_mode, local_copy_workers, local_db_snapshot, visualization_workers, ldavis_n_jobs, ldavis_sort_topics, plot_workers, vw_compact, vw_compression, artm_batch_workers
+from modules.preprocessing import PreProcessor as pp, TokenCache, StreamingCorpusWriter, CorpusManifest, IncrementalCorpus, TermFrequencyStore, PlotRenderer, TokenCorpus, VWWriter, ARTMBatchWriter
+from modules.modeling import LatentDirichletAllocation as lda, LDAVisualizer
+from modules.pipeline import AsyncPipeline
+#heavy libraries (gensim, pyLDAvis, matplotlib, spaCy, wordcloud, pyzotero) are imported where they are used
+warnings.filterwarnings("ignore", category=DeprecationWarning, module="matplotlib.*")
 with warnings.catch_warnings():
     warnings.filterwarnings("ignore", category=DeprecationWarning, module="pyLDAvis.*")
 
@@ -15,16 +18,22 @@ def main():
     '''Main method'''
     interface   = cmdi()
     args        = interface.parse_arguments(argument_dict)
+    #overlapping downloads with extraction only applies to files downloaded in this run
+    overlap     = args.ov and not args.ul and not args.inc
+    pdf_url_map = None
     if args.ul:
         local_conn = llc()
-        local_conn.connect_to_db()
-        local_conn.query_local_zotero(collection_name=args.c)
-        local_conn.get_local_copies(save_path=args.o)
+        local_conn.connect_to_db(snapshot=local_db_snapshot)
+        #no collection name - query finds no documents and analysis is aborted
+        collections = [name.strip() for name in (args.c or '').split(';') if name.strip()]
+        local_conn.query_local_zotero(collection_name=collections)
+        local_conn.close()
+        local_conn.get_local_copies(save_path=args.o, mode=local_copy_mode, max_workers=local_copy_workers)
     else:
         #downloading from Zotero api and scraping available full-text pdfs
         zc          = elc.connect_zotero(
             library_id=LIB_ID, 
-            api_key=API_KEY, 
+            api_key=get_api_key(), 
             library_type='user'
             )
         mapping     = elc.map_colname_colid_zotero(
@@ -39,54 +48,267 @@ def main():
             col_name=args.c, 
             force_run=args.fa
             )
-        elc.download_files(args.o, pdf_url_map)
-
-    pdf_gen     = pp.preprocess_generator(tp.pdf_generator(args.o), 
-                                          output_path=os.path.join(args.o, 'wordclouds/'), 
-                                          stemming_alg=stemming_algorithm, 
-                                          ext_stopword_list=extended_stopword_list,
-                                           n_gram_value=int(args.ng),
-                                           wordclouds=args.wc,
-                                           tf_plots=args.tfp,
-                                           tokenizer=tokenizer_alg,
-                                           lower_fth=lower_freq_th,
-                                           upper_fth=upper_freq_th
-                                           )
-    docs,names = [],[]
-    for doc in pdf_gen:
-        docs.append(doc['result'])
-        names.append(doc['name'])
+        if not overlap:
+            elc.download_files(args.o, pdf_url_map)
+
+    n_gram_values = cmdi.parse_int_list(args.ng)
+    freq_filter = freq_filter_scope
+    if (args.st or args.inc) and freq_filter == 'corpus':
+        print('Corpus-wide frequency filtering requires all documents in memory - using per-document filtering in streaming/incremental mode.')
+        freq_filter = 'document'
+    #keeping original file names when single n-gram length is requested
+    file_names = {n:args.m if len(n_gram_values) == 1 else f'{args.m}_{n}' for n in n_gram_values}
+    pdf_paths, manifest, retracted = None, None, []
+    if args.inc:
+        manifest = CorpusManifest(args.o, settings={
+            'n_gram_values':n_gram_values,
+            'tokenizer':tokenizer_alg,
+            'stemming':stemming_algorithm,
+            'stopwords':extended_stopword_list,
+            'lower_freq_th':lower_freq_th,
+            'upper_freq_th':upper_freq_th,
+            'cooc_window_size':cooc_window_size,
+            'vw_compact':vw_compact,
+            'vw_compression':vw_compression,
+            'file_names':[file_names[n] for n in n_gram_values]
+            }, state_paths=[os.path.join(args.o, '.incremental', file_name) for file_name in file_names.values()])
+        pdf_paths, retracted = manifest.diff(glob(os.path.join(args.o, '*.pdf')))
+    token_cache = None
+    if not args.nc:
+        token_cache = TokenCache(
+            TOKEN_CACHE_PATH, 
+            tokenizer=tokenizer_alg, 
+            ext_stopword_list=extended_stopword_list, 
+            stemming_alg=stemming_algorithm,
+            max_size_mb=token_cache_max_size_mb,
+            max_age_days=token_cache_max_age_days
+            )
+    doc_kwargs = {
+        'stemming_alg':stemming_algorithm, 
+        'ext_stopword_list':extended_stopword_list,
+        'n_gram_value':n_gram_values,
+        #plots are rendered by PlotRenderer from preprocessed documents
+        'wordclouds':False,
+        'tf_plots':False,
+        'tokenizer':tokenizer_alg,
+        'lower_fth':lower_freq_th,
+        'upper_fth':upper_freq_th,
+        'freq_filter':freq_filter,
+        'token_cache':token_cache
+        }
+    skip = token_cache.contains if token_cache is not None else None
+    if overlap:
+        pdf_gen = AsyncPipeline(
+            save_path=args.o, 
+            name_url_dict=pdf_url_map,
+            image_path=os.path.join(args.o, 'wordclouds/'),
+            preprocess_kwargs=doc_kwargs,
+            extraction_workers=max(extraction_workers, 1),
+            preprocessing_workers=int(args.w),
+            queue_size=pipeline_queue_size,
+            extraction_timeout=extraction_timeout,
+            force_run=args.fa,
+            skip=skip
+            ).generator()
+    else:
+        text_gen    = tp.pdf_generator(args.o, 
+                                       workers=extraction_workers, 
+                                       timeout=extraction_timeout, 
+                                       ordered=ordered_extraction,
+                                       skip=skip,
+                                       paths=pdf_paths
+                                       )
+        pdf_gen     = pp.preprocess_generator(text_gen, 
+                                              output_path=os.path.join(args.o, 'wordclouds/'), 
+                                              workers=int(args.w),
+                                              **doc_kwargs
+                                              )
+    renderer = None
+    if args.wc or args.tfp:
+        renderer = PlotRenderer(os.path.join(args.o, 'wordclouds/'), wordclouds=args.wc, tf_plots=args.tfp, workers=plot_workers)
+        pdf_gen = renderer.render_documents(pdf_gen, n_gram_values)
+    visualizer = None
+    if not args.sm and not args.nv:
+        visualizer = LDAVisualizer(workers=visualization_workers, n_jobs=ldavis_n_jobs, sort_topics=ldavis_sort_topics)
+    if args.inc:
+        update_ngram_orders(pdf_gen, manifest=manifest, retracted=retracted, file_names=file_names, args=args, visualizer=visualizer)
+    elif args.st:
+        stream_ngram_orders(pdf_gen, file_names=file_names, args=args, visualizer=visualizer)
+    else:
+        corpora = {n:TokenCorpus() for n in n_gram_values}
+        for doc in pdf_gen:
+            for n in n_gram_values:
+                corpora[n].add(doc['name'], doc['result'][n])
+        for n in n_gram_values:
+            process_ngram_order(corpus=corpora.pop(n), n_gram_value=n, file_name=file_names[n], args=args, visualizer=visualizer)
+    if visualizer is not None:
+        visualizer.close()
+    if renderer is not None:
+        renderer.close()
+    if token_cache is not None:
+        token_cache.evict()
+
+
+def process_ngram_order(corpus:TokenCorpus, n_gram_value:int, file_name:str, args, visualizer=None):
+    '''Builds vocabulary, co-occurrence and VW files (and optionally topic model) for documents represented by n-grams of single length'''
     if args.tfp:
-        pp.aggragate_tfs(output_path=args.o, n_gram_value=int(args.ng))
-    vocab = pp.gen_vocab(docs)
-    bow_gen     = pp.bow_generator(docs, vocab=vocab)
-    corpus      = [bow for bow in bow_gen]
+        tf_store = TermFrequencyStore(os.path.join(args.o, 'tf_store', str(n_gram_value)))
+        for name, doc in zip(corpus.names, corpus):
+            tf_store.add(name, doc)
+        tf_store.close()
+        pp.aggragate_tfs(output_path=args.o, n_gram_value=n_gram_value, store_path=tf_store.store_path)
+    if freq_filter_scope == 'corpus' and n_gram_value > 1:
+        corpus = pp.filter_corpus_by_frequency(corpus, upper_th=upper_freq_th, lower_th=lower_freq_th)
+    vocab = pp.gen_vocab(corpus)
 
     pp.get_cooc_vocab(
-            docs=docs, 
+            docs=corpus, 
             vocab=vocab, 
-            vocab_path=os.path.join(args.o, f'vocab_{args.ng}.txt'), 
-            cooc_path=os.path.join(args.o,f'cooc_{args.ng}.txt'), 
-            window=cooc_window_size
+            vocab_path=os.path.join(args.o, f'vocab_{n_gram_value}.txt'), 
+            cooc_path=os.path.join(args.o,f'cooc_{n_gram_value}.txt'), 
+            window=cooc_window_size,
+            engine=cooc_engine
             )
 
     pp.save_corpus_to_vw(
-        docs=docs,
-        names=names,
+        docs=corpus,
         output_path=args.o,
-        file_name=args.m
+        file_name=file_name
+        )
+    if args.ab:
+        export_artm_batches(ARTMBatchWriter.corpus_shards(corpus, batch_size=int(args.bs)), n_gram_value=n_gram_value, file_name=file_name, args=args)
+    mm_path = os.path.join(args.o, f'{file_name}_corpus.mm')
+    if not args.sm:
+        #topic model is trained from corpus streamed from disk instead of in-memory list of bag-of-words
+        from gensim.corpora import MmCorpus
+        MmCorpus.serialize(mm_path, pp.bow_generator(corpus, vocab=vocab), id2word=vocab)
+    run_topic_model(corpus_path=mm_path, vocab=vocab, file_name=file_name, args=args, visualizer=visualizer)
+
+
+def stream_ngram_orders(pdf_gen, file_names:dict, args, visualizer=None):
+    '''
+    Streaming alternative to process_ngram_order - each document passes through the pipeline once,
+    vocabulary, co-occurrence counts and VW file are updated incrementally and bag-of-words corpus is saved in Matrix Market format.
+    '''
+    writers = {n:StreamingCorpusWriter(output_path=args.o, file_name=file_name, window=cooc_window_size) for n, file_name in file_names.items()}
+    tf_stores = {n:TermFrequencyStore(os.path.join(args.o, 'tf_store', str(n))) for n in file_names} if args.tfp else {}
+    for doc in pdf_gen:
+        for n, writer in writers.items():
+            writer.add(doc['name'], doc['result'][n])
+        for n, tf_store in tf_stores.items():
+            tf_store.add(doc['name'], doc['result'][n])
+    for n, writer in writers.items():
+        vocab = writer.close(
+            vocab_path=os.path.join(args.o, f'vocab_{n}.txt'), 
+            cooc_path=os.path.join(args.o,f'cooc_{n}.txt')
+            )
+        if args.ab:
+            export_artm_batches(ARTMBatchWriter.vw_shards(writer.vw_path, batch_size=int(args.bs)), n_gram_value=n, file_name=file_names[n], args=args)
+        if args.tfp:
+            tf_stores[n].close()
+            pp.aggragate_tfs(output_path=args.o, n_gram_value=n, store_path=tf_stores[n].store_path)
+        run_topic_model(corpus_path=writer.mm_path, vocab=vocab, file_name=file_names[n], args=args, visualizer=visualizer)
+
+
+def update_ngram_orders(pdf_gen, manifest, retracted:list, file_names:dict, args, visualizer=None):
+    '''
+    Incremental alternative to process_ngram_order - contributions of retracted documents are removed and 
+    new documents are merged into vocabulary, co-occurrence counts and VW file kept in the output folder.
+    '''
+    inc_corpora = {n:IncrementalCorpus(
+        os.path.join(args.o, '.incremental', file_name), 
+        window=cooc_window_size, 
+        reset=manifest.reset
+        ) for n, file_name in file_names.items()}
+    for name in retracted:
+        for corpus in inc_corpora.values():
+            corpus.retract(name)
+    added = []
+    for doc in pdf_gen:
+        name = os.path.basename(doc['name'])
+        for n, corpus in inc_corpora.items():
+            corpus.add(name, doc['result'][n])
+        added.append(name)
+    for n, corpus in inc_corpora.items():
+        mm_path = os.path.join(args.o, f'{file_names[n]}_corpus.mm')
+        vw_path = VWWriter.file_path(args.o, file_names[n], vw_compression)
+        vocab = corpus.close(
+            vocab_path=os.path.join(args.o, f'vocab_{n}.txt'), 
+            cooc_path=os.path.join(args.o,f'cooc_{n}.txt'),
+            vw_path=vw_path,
+            mm_path=mm_path
+            )
+        if args.ab:
+            #batches are rewritten from the merged VW file, so they cover unchanged documents as well
+            export_artm_batches(ARTMBatchWriter.vw_shards(vw_path, batch_size=int(args.bs)), n_gram_value=n, file_name=file_names[n], args=args)
+        if args.tfp:
+            #term frequencies of the whole collection - unchanged documents are read from incremental state
+            tf_store = TermFrequencyStore(os.path.join(args.o, 'tf_store', str(n)))
+            for name, doc in corpus.documents():
+                tf_store.add(name, doc)
+            tf_store.close()
+            pp.aggragate_tfs(output_path=args.o, n_gram_value=n, store_path=tf_store.store_path)
+        run_topic_model(corpus_path=mm_path, vocab=vocab, file_name=file_names[n], args=args, visualizer=visualizer)
+    manifest.update(added=added, retracted=retracted)
+
+
+def export_artm_batches(shards, n_gram_value:int, file_name:str, args):
+    '''
+    Writes BigARTM batches of the n-gram order in parallel and saves dictionary gathered from them with vocabulary and co-occurrence files,
+    so that ARTM experiments can load <file_name>_batches with data_format='batches' and <file_name>_dictionary.dict directly.
+    '''
+    batch_folder = os.path.join(args.o, f'{file_name}_batches')
+    ARTMBatchWriter.write_batches(shards, batch_folder, workers=artm_batch_workers)
+    ARTMBatchWriter.write_dictionary(
+        batch_folder, 
+        dictionary_path=os.path.join(args.o, f'{file_name}_dictionary.dict'),
+        vocab_path=os.path.join(args.o, f'vocab_{n_gram_value}.txt'),
+        cooc_path=os.path.join(args.o, f'cooc_{n_gram_value}.txt')
         )
+
+
+def run_topic_model(corpus_path:str, vocab, file_name:str, args, visualizer=None):
+    '''
+    Trains (or loads) topic model selected in command-line arguments from corpus saved in Matrix Market format.
+    Several numbers of topics (--nt list or range) are trained concurrently and compared in a summary table.
+    visualizer - LDAVisualizer preparing pyLDAvis visualizations of trained models, None to skip visualization.
+    '''
     if not args.sm:
         if args.mr == 'lda_gensim':
+            os.makedirs('./models', exist_ok=True)
+            topic_counts = cmdi.parse_int_list(args.nt)
+            model_paths = {nt:f'./models/{file_name}_{args.mr}_{nt}_tpcs.model' for nt in topic_counts}
+            visual_paths = {nt:os.path.join(args.o,f'{file_name}_{args.mr}_{nt}_tpcs') for nt in topic_counts}
+            training_params = {
+                'chunksize':int(args.cs),
+                'passes':int(args.ps),
+                'iterations':int(args.it),
+                'eval_every':int(args.ee)
+                }
             try: 
-                lda.run_default_gensim_lda(
-                    corpus=corpus,
-                    vocab=vocab,
-                    model_path= f'./models/{args.m}_{args.mr}_{args.nt}_tpcs.model',
-                    num_topics = args.nt,
-                    visualize_lda=True,
-                    visual_path=os.path.join(args.o,f'{args.m}_{args.mr}_{args.nt}_tpcs')
-                    )
+                if len(topic_counts) > 1:
+                    lda.sweep_gensim_lda(
+                        corpus_path=corpus_path,
+                        vocab=vocab,
+                        model_paths=model_paths,
+                        summary_path=os.path.join(args.o, f'{file_name}_{args.mr}_topic_sweep.csv'),
+                        max_workers=int(args.lw) or None,
+                        training_params=training_params
+                        )
+                else:
+                    from gensim.corpora import MmCorpus
+                    nt = topic_counts[0]
+                    lda.run_default_gensim_lda(
+                        corpus=MmCorpus(corpus_path),
+                        vocab=vocab,
+                        model_path=model_paths[nt],
+                        num_topics=nt,
+                        visualize_lda=False,
+                        training_params={'workers':int(args.lw), **training_params}
+                        )
+                if visualizer is not None:
+                    for nt in topic_counts:
+                        visualizer.submit(model_path=model_paths[nt], corpus_path=corpus_path, vocab=vocab, output_path=visual_paths[nt])
             except IndexError:
                 print('Please try to increase the number of expected topics.')
     else:
@@ -11,6 +11,26 @@ config_vars
 
 '''
 
+#########
+#modeling
+#########
+
+#LDA training configurations - defaults of the corresponding command-line arguments
+lda_workers = 0 #number of LdaMulticore worker processes, 0 - number of cores minus one
+lda_chunksize = 2000 #documents per training chunk
+lda_passes = 1 #passes over the corpus
+lda_iterations = 50 #max E-step iterations per document
+lda_eval_every = 0 #gensim eval_every - estimate perplexity every n chunk updates, 0 - no perplexity estimates
+
+#pyLDAvis visualization configurations
+visualization_workers = 1 #background processes preparing visualizations while next models are trained, 0 - prepare synchronously
+ldavis_n_jobs = -1 #joblib processes used by pyLDAvis prepare, -1 - all cores
+ldavis_sort_topics = True #False - keep gensim topic order and skip sorting topics by size
+
+#BigARTM batch export configurations (--ab)
+artm_batch_size = 1000 #documents per BigARTM batch file
+artm_batch_workers = 4 #processes serializing batch files, 0 - write in main process
+
 ##############
 #input_parsing
 ##############
@@ -25,18 +45,31 @@ argument_dict = {
                     'arguments':[
                         ['--l','--library_name','Name of the Zotero library to parse.', None],
                         ['--mr', '--run_model', 'Name of the model to run. Currently only gensim lda supported', 'lda_gensim'],
-                        ['--nt', '--num_topics', 'Number of topics to be discovered by the topic model.', 3],
-                        ['--c','--collection_name','Name of the collection to parse', None],
+                        ['--nt', '--num_topics', 'Number of topics to be discovered by the topic model, list (5,10,20) or range (5-20) to train and compare several models.', 3],
+                        ['--c','--collection_name','Name of the collection to parse - with --ul several collections can be separated by ";"', None],
                         ['--d','--depth','depth to go to in collection, -1 stands for full depth', -1],
                         ['--m','--model_file_name','Name of model to name the files.', 'model'],
-                        ['--ng','--nram_len','Length of the n-gram', 1],
+                        ['--ng','--nram_len','Length of the n-gram, list (1,2,3) or range (1-10) to process several lengths in a single run', 1],
+                        ['--w','--workers','Number of processes used for document preprocessing.', 1],
+                        ['--lw','--lda_workers','Number of LDA training processes (models trained in parallel with --nt list or range), 0 - number of cores (minus one for single model).', lda_workers],
+                        ['--cs','--chunksize','Number of documents per LDA training chunk.', lda_chunksize],
+                        ['--ps','--passes','Number of LDA training passes over the corpus.', lda_passes],
+                        ['--it','--iterations','Max number of LDA inference iterations per document.', lda_iterations],
+                        ['--ee','--eval_every','Estimate LDA perplexity every n chunk updates, 0 - no perplexity estimates.', lda_eval_every],
+                        ['--bs','--batch_size','Number of documents per BigARTM batch file (--ab).', artm_batch_size],
                     ],
                     'flags':[
                         ['--ul','--use_local', 'Flag to analyze locally-stored copies of publications instead of downloading from links.'],
                         ['--fa','--force_all','Flag to rerun the analysis starting from downloading the collection.'],
                         ['--sm','--skip_model','Flag to skip topic modeling'],
+                        ['--nv','--no_visualization','Flag to skip pyLDAvis visualization of trained topic models'],
                         ['--wc','--word_clouds','Flag to generate wordcloud plot for each pdf file'],
                         ['--tfp','--tf_plots','Flag to generate term frequency plot for each pdf file'],
+                        ['--st','--streaming','Flag to process documents in a single streaming pass with constant memory (corpus is saved in Matrix Market format)'],
+                        ['--ov','--overlap','Flag to overlap downloading with text extraction and preprocessing (asyncio pipeline, ignored with --ul and --inc)'],
+                        ['--inc','--incremental','Flag to process only new or changed pdf files and merge them into corpus files kept in the output folder'],
+                        ['--nc','--no_cache','Flag to disable the cache of cleaned tokens and preprocess all pdf files from scratch'],
+                        ['--ab','--artm_batches','Flag to write BigARTM batches (<model>_batches folder) and dictionary (<model>_dictionary.dict) to load with data_format="batches"'],
                     ]
                 }
             }
@@ -51,10 +84,37 @@ host_filters = [
     'sciencedirectassets.com'
     ]
 
-with open('.secrets', 'r+') as f:
-    API_KEY = f.read().strip()
+#Download configurations
+download_per_host_limit = 2 #max number of concurrent requests (and pooled connections) per host
+download_timeout = (10, 60) #connect and read timeouts in seconds
+download_retries = 3 #retries for connection errors, timeouts and 429/5xx responses
+download_backoff = 1.0 #seconds, doubled after each retry
+deep_pdf_validation = False #True - parse downloaded arXiv files with PdfReader, False - only check pdf header and trailer
+
+SECRETS_PATH = '.secrets'
+def get_api_key() -> str:
+    '''Reads Zotero API key from SECRETS_PATH - only needed when the Zotero web API is used.'''
+    with open(SECRETS_PATH, 'r') as f:
+        return f.read().strip()
 LIB_ID = 11755354
 BACKUP_PATH = './backup'
+ZOTERO_CACHE_PATH = './backup/zotero_items.sqlite' #local cache of Zotero items keyed by version
+
+#Local Zotero storage configurations
+local_copy_mode = 'copy' #'copy', 'hardlink' or 'symlink' - how files from local Zotero storage are placed into output folder
+local_copy_workers = 8
+local_db_snapshot = False #query a temporary copy of zotero.sqlite instead of opening the live file read-only
+
+#Text extraction configurations
+extraction_workers = 1 #number of processes used to extract text from pdf files, 1 - sequential extraction
+extraction_timeout = 120 #maximum number of seconds spent on extracting text from a single pdf file
+ordered_extraction = True #False - yield documents as soon as extraction is complete
+pipeline_queue_size = 8 #max number of documents waiting between stages of overlapping download pipeline (--ov)
+
+#Token cache configurations
+TOKEN_CACHE_PATH = './cache/tokens'
+token_cache_max_size_mb = 1024
+token_cache_max_age_days = 30
 
 #Preprocessing configurations
 stemming_algorithm = None #'Porter' Or Snowball
@@ -64,7 +124,15 @@ extended_stopword_list = ['from', 'subject', 'edu', 'etc', 'use','https', 'http'
                           'example', 'ncbi', 'table', 'etal','hours', 'list', 'assessment', 'sit', 'resit', 'reading', 'first', 
                           'proquest', 'weighting', 'obligatoryfinalgroup','work', 'elementselement', 'description', 'course', 'examination']
 word_cloud_plots = False
+plot_workers = 1 #background processes rendering wordcloud and term frequency plots (--wc/--tfp), 0 - render in main process
+plot_queue_size = 256 #max number of plots waiting for rendering before preprocessing is paused
 tokenizer_alg = 'nltk'
+spacy_batch_size = 64 #pages per nlp.pipe batch when tokenizer_alg = 'spacy'
+token_score_cache_size = 2**18 #max number of tokens with memoized quality scores per process
 lower_freq_th = 3
 upper_freq_th = 950
+freq_filter_scope = 'document' #'document' - thresholds applied within each document, 'corpus' - accross the entire collection
 cooc_window_size = 10
+vw_compact = True #True - Vowpal Wabbit documents as token:count pairs, False - every token occurrence is repeated
+vw_compression = None #None, 'gzip' or 'zstd' (requires zstandard package) - compression of Vowpal Wabbit files
+cooc_engine = 'sparse' #'sparse' - vectorized numpy/scipy counting, 'python' - reference python implementation
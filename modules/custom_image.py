@@ -3,6 +3,7 @@ import glob
 import os
 import re
 from matplotlib import pyplot as plt
+from modules.preprocessing import VWReader
 
 # DATASET_PATH = os.path.abspath('Data/nlp_set/nlp_set_2_vw.txt')
 # METADATA_PATH = os.path.abspath('Data/metadata/NLP_set.csv')
@@ -79,10 +80,8 @@ def main(meta_path, n, image_customization):
     n: n-gram (used for tags)
     image_customization: a dictionary containing customization options for each plot, including save paths
     """
-    with open(DATASET_PATH, 'r+') as f:
-        data = f.readlines()
     metadata = pd.read_csv(meta_path)
-    count_dict = {l.split(' ')[0]: len(l.split(' ')[1:]) for l in data}
+    count_dict = {doc_id: sum(counts.values()) for doc_id, counts in VWReader.documents(DATASET_PATH)}
     count_df = pd.DataFrame.from_dict(count_dict, orient='index').reset_index()
     count_df.columns = ['name', 'bigram_counts']
 
@@ -2,19 +2,25 @@ import argparse
 import sys
 import logging 
 import getpass
-import requests
 import os
 import json
-import urllib.request as libreq
 import sqlite3
 import shutil
-
-from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor
-from .config import BACKUP_PATH, host_filters
+import copy
+import itertools
+import signal
+import math
+import threading
+import time
+import pathlib
+import tempfile
+
+from urllib.parse import urlparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .config import BACKUP_PATH, ZOTERO_CACHE_PATH, host_filters, download_per_host_limit, download_timeout, download_retries, download_backoff, deep_pdf_validation
 from glob import glob
-from pyzotero import zotero
-from PyPDF2 import PdfReader, PdfWriter, errors as pdf_errors
+from PyPDF2 import PdfReader, errors as pdf_errors
 
 
 #######################
@@ -34,16 +40,19 @@ def download_arxiv(*args, **kwargs):
     save_path - path to the folder where the file should be saved
     name - name of the resulting pdf file
 
-    Scope: API call wrapper for arXiv
+    engine - DownloadEngine used for the request (new engine is created if not provided)
+    deep_validation - parse downloaded file with PdfReader in addition to header/trailer check
+
+    Scope: API call wrapper for arXiv - response is streamed straight to disk, 
+    the file is only kept if it passes pdf integrity check.
     '''
-    with libreq.urlopen(kwargs['url']) as url:
-        pdf_bytes = url.read()
-    reader = PdfReader(BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    with open(os.path.join(kwargs['save_path'], kwargs['name']), 'wb') as outfile:
-        writer.write(outfile)
+    engine = kwargs.get('engine') or DownloadEngine()
+    deep_validation = kwargs.get('deep_validation', deep_pdf_validation)
+    return engine.fetch(
+        kwargs['url'], 
+        os.path.join(kwargs['save_path'], kwargs['name']), 
+        validate=lambda path: TextParser.is_valid_pdf(path, deep=deep_validation)
+        )
 
 
 def download_ncbi_researchgate(*args, **kwargs):
@@ -51,12 +60,147 @@ def download_ncbi_researchgate(*args, **kwargs):
     url - link to the pdf file to be downloaded
     save_path - path to the folder where the file should be saved
     name - name of the resulting pdf file
+    engine - DownloadEngine used for the request (new engine is created if not provided)
 
     Scope: API call wrapper for ncbi & researchgate'''
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-    response = requests.get(kwargs['url'], headers=headers)
-    with open(os.path.join(kwargs['save_path'], kwargs['name']), 'wb') as outfile:
-        outfile.write(response.content)
+    engine = kwargs.get('engine') or DownloadEngine()
+    return engine.fetch(kwargs['url'], os.path.join(kwargs['save_path'], kwargs['name']), headers=headers)
+
+
+class DownloadEngine():
+    '''
+    HTTP download engine shared by download workers.
+    Keeps one pooled requests.Session per host with a limit of concurrent requests per host,
+    retries connection errors, timeouts and retryable status codes with exponential backoff,
+    streams response body to disk in chunks and records download counters.
+    '''
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, per_host_limit:int=2, timeout:tuple=(10, 60), retries:int=3, backoff:float=1.0, chunk_size:int=1 << 16):
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self._sessions = {}
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self.stats = {'succeeded':0, 'failed':0, 'skipped':0, 'bytes':0, 'seconds':0.0}
+
+
+    def _host(self, url:str):
+        '''Returns pooled session and concurrency limit for host of url.'''
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._sessions:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host_limit)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._sessions[host], self._host_limits[host]
+
+
+    def record(self, outcome:str, num_bytes:int=0, seconds:float=0.0) -> None:
+        '''Thread-safe update of download counters, outcome - succeeded/failed/skipped.'''
+        with self._lock:
+            self.stats[outcome] += 1
+            self.stats['bytes'] += num_bytes
+            self.stats['seconds'] += seconds
+
+
+    @staticmethod
+    def retryable_errors() -> tuple:
+        '''Request exceptions worth retrying - connection problems (including connections dropped while reading body), timeouts and retryable status codes.'''
+        import requests
+        return (
+            requests.ConnectionError, 
+            requests.Timeout, 
+            requests.HTTPError, 
+            requests.exceptions.ChunkedEncodingError, 
+            requests.exceptions.ContentDecodingError
+            )
+
+
+    def fetch(self, url:str, file_path:str, headers:dict=None, validate=None) -> bool:
+        '''
+        Downloads url to file_path, returns True if download succeeded.
+        validate - callable taking path to downloaded (temporary) file, file is discarded if it returns False
+        '''
+        import requests
+        session, host_limit = self._host(url)
+        start = time.perf_counter()
+        with host_limit:
+            for attempt in range(self.retries + 1):
+                try:
+                    with session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                        if response.status_code in DownloadEngine.RETRY_STATUS and attempt < self.retries:
+                            raise requests.HTTPError(f'status code: {response.status_code}')
+                        if response.status_code != 200:
+                            logging.error(f'Failed to download file - status code: {response.status_code}\nURL: {url}\nName:{os.path.basename(file_path)}')
+                            self.record('failed', seconds=time.perf_counter() - start)
+                            return False
+                        num_bytes = self.write_stream(response, file_path, validate=validate)
+                    self.record('succeeded', num_bytes=num_bytes, seconds=time.perf_counter() - start)
+                    logging.info(f'Succesfully downloaded file - status code: {response.status_code}\nURL: {url}\nName:{os.path.basename(file_path)}\nLocation: {os.path.dirname(file_path)}')
+                    return True
+                except ValueError as e:
+                    logging.error(f'Failed to download file - {e}\nURL: {url}\nName:{os.path.basename(file_path)}')
+                    self.record('failed', seconds=time.perf_counter() - start)
+                    return False
+                except DownloadEngine.retryable_errors() as e:
+                    if attempt == self.retries:
+                        logging.error(f'Failed to download file after {attempt + 1} attempts - {e}\nURL: {url}')
+                        self.record('failed', seconds=time.perf_counter() - start)
+                        return False
+                    delay = self.backoff * 2 ** attempt
+                    logging.warning(f'Retrying download in {delay} s - {e}\nURL: {url}')
+                    time.sleep(delay)
+                except (requests.RequestException, OSError) as e:
+                    logging.error(f'Failed to download file - {e}\nURL: {url}\nName:{os.path.basename(file_path)}')
+                    self.record('failed', seconds=time.perf_counter() - start)
+                    return False
+
+
+    def write_stream(self, response, file_path:str, validate=None) -> int:
+        '''
+        Writes response body to file_path chunk by chunk (through temporary file), returns number of bytes written.
+        Raises ValueError if validate callable rejects the downloaded file.
+        '''
+        tmp_path = f'{file_path}.part'
+        num_bytes = 0
+        try:
+            with open(tmp_path, 'wb') as outfile:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    outfile.write(chunk)
+                    num_bytes += len(chunk)
+            if validate is not None and not validate(tmp_path):
+                raise ValueError('downloaded file failed integrity check')
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return num_bytes
+
+
+    def summary(self, wall_time:float=None) -> dict:
+        '''Download counters with throughput in MB/s (over wall_time if given, otherwise over summed download time).'''
+        with self._lock:
+            stats = dict(self.stats)
+        seconds = wall_time if wall_time is not None else stats['seconds']
+        stats['throughput_mb_s'] = round(stats['bytes'] / 1024 / 1024 / seconds, 3) if seconds > 0 else 0.0
+        return stats
+
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
 
 
 ##########
@@ -118,6 +262,27 @@ class CMDInterface():
             return args
     
 
+    @staticmethod
+    def parse_int_list(value) -> list:
+        '''
+        Parses command-line value into sorted list of unique integers.
+        Accepts single values (2), ranges (1-10), comma-separated values (1,2,5) and combinations (1-3,5).
+        '''
+        values = set()
+        for part in str(value).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part.lstrip('-'):
+                start, end = part.rsplit('-', 1)
+                values.update(range(int(start), int(end) + 1))
+            else:
+                values.add(int(part))
+        if not values:
+            raise ValueError(f'No integer values could be parsed from {value}')
+        return sorted(values)
+
+
     @staticmethod
     def request_api_key():
         '''Requesting API key securely'''
@@ -149,6 +314,9 @@ class TextParser():
             num_pages = len(reader.pages)
             file = {'name': path, 'text':{i:reader.pages[i].extract_text() for i in range(num_pages)}}
             return file
+        except TimeoutError:
+            #raised by read_pdf_with_timeout alarm - slow file is not corrupted and must not be removed
+            raise
         except Exception as e:
             logging.error(f'Failed to read presumed pdf file: {path} - {e}')
             if remove_corrupted:
@@ -158,12 +326,101 @@ class TextParser():
     
 
     @staticmethod
-    def pdf_generator(folder_path):
-        '''Generator to parse all pdf files from folder_path'''
-        pdf_list = glob(os.path.join(folder_path,'*.pdf'))
-        for path in pdf_list:
-            pdf = TextParser.read_pdf(path)
-            if pdf is not None: yield pdf
+    def is_valid_pdf(path, deep:bool=False) -> bool:
+        '''
+        Cheap pdf integrity check - "%PDF-" header at the start and "%%EOF" marker at the end of the file.
+        deep - additionally parse the file with PdfReader and check that pages can be loaded.
+        '''
+        try:
+            size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                head = f.read(1024)
+                f.seek(max(size - 2048, 0))
+                tail = f.read()
+            if b'%PDF-' not in head or b'%%EOF' not in tail:
+                return False
+            if deep:
+                return len(PdfReader(path).pages) > 0
+            return True
+        except Exception as e:
+            logging.error(f'Failed to validate presumed pdf file: {path} - {e}')
+            return False
+
+
+    @staticmethod
+    def read_pdf_with_timeout(path, timeout=None, remove_corrupted=True) -> dict:
+        '''
+        Wrapper for read_pdf to be executed in a worker process - 
+        extraction is interrupted if it takes longer than timeout seconds (POSIX only).
+        '''
+        use_alarm = timeout is not None and hasattr(signal, 'SIGALRM')
+        if use_alarm:
+            def on_timeout(signum, frame):
+                raise TimeoutError(f'extraction took longer than {timeout} s')
+            signal.signal(signal.SIGALRM, on_timeout)
+            signal.alarm(int(math.ceil(timeout)))
+        try:
+            return TextParser.read_pdf(path, remove_corrupted=remove_corrupted)
+        except TimeoutError as e:
+            #slow, but not necessarily corrupted - file is kept
+            logging.error(f'Skipping pdf file: {path} - {e}')
+            return
+        finally:
+            if use_alarm:
+                signal.alarm(0)
+
+
+    @staticmethod
+    def pdf_generator(folder_path, workers:int=1, timeout:float=None, ordered:bool=True, remove_corrupted:bool=True, skip=None, paths:list=None):
+        '''
+        Generator to parse all pdf files from folder_path
+        workers - number of processes used for text extraction, 1 - sequential extraction in current process
+        timeout - maximum number of seconds spent on a single file (only applies to process pool)
+        ordered - yield files in glob order, otherwise files are yielded as soon as extraction is complete
+        skip - callable taking file path, files for which it returns True are not parsed and yielded with text=None
+        paths - explicit list of pdf files to parse instead of all pdf files from folder_path
+        '''
+        pdf_list = glob(os.path.join(folder_path,'*.pdf')) if paths is None else list(paths)
+        #skipped files keep their position, so that document order does not depend on the state of the cache
+        is_skipped = skip if skip is not None else lambda path: False
+        if workers is None or int(workers) <= 1:
+            for path in pdf_list:
+                if is_skipped(path):
+                    yield {'name':path, 'text':None}
+                    continue
+                pdf = TextParser.read_pdf(path, remove_corrupted=remove_corrupted)
+                if pdf is not None: yield pdf
+            return
+
+        logging.info(f'Extracting text from {len(pdf_list)} pdf files using {workers} processes.')
+        with ProcessPoolExecutor(max_workers=int(workers)) as executor:
+            def submit(path):
+                if is_skipped(path):
+                    return {'name':path, 'text':None}
+                return executor.submit(TextParser.read_pdf_with_timeout, path, timeout, remove_corrupted)
+
+            #bounded number of files in flight, so that extracted texts do not pile up in completed futures
+            paths = iter(pdf_list)
+            pending = deque(submit(path) for path in itertools.islice(paths, int(workers) * 2))
+            while pending:
+                if ordered:
+                    item = pending.popleft()
+                else:
+                    item = next((item for item in pending if isinstance(item, dict)), None)
+                    if item is None:
+                        item = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+                    pending.remove(item)
+                #next file is submitted before the result is yielded, so workers stay busy while it is consumed
+                pending.extend(submit(path) for path in itertools.islice(paths, 1))
+                if isinstance(item, dict):
+                    yield item
+                    continue
+                try:
+                    pdf = item.result()
+                except Exception as e:
+                    logging.error(f'Text extraction worker failed - {e}')
+                    continue
+                if pdf is not None: yield pdf
 
         
 
@@ -193,86 +450,192 @@ class LocalLibConnector():
         else:
             self._zotero_home = home_wsl
 
-    def connect_to_db(self):
+    def connect_to_db(self, snapshot:bool=False):
+        '''
+        Opens the local Zotero database read-only, so that it can be queried while Zotero is running.
+        snapshot - query a temporary copy of the database instead of the live file.
+        '''
+        self.conn = None
+        self._snapshot_dir = None
         db_path = os.path.join(self._zotero_home, 'zotero.sqlite')
         if not os.path.exists(db_path):
             print("Database file not found in Zotero directory.")
             return None
 
         try:
-            # Connect to the Zotero SQLite database
-            self.conn = sqlite3.connect(db_path)
+            if snapshot:
+                self._snapshot_dir = tempfile.mkdtemp(prefix='zotero_snapshot_')
+                for suffix in ('', '-wal'):
+                    if os.path.isfile(db_path + suffix):
+                        shutil.copyfile(db_path + suffix, os.path.join(self._snapshot_dir, 'zotero.sqlite' + suffix))
+                db_path = os.path.join(self._snapshot_dir, 'zotero.sqlite')
+            # Zotero keeps the live database locked - immutable mode skips locking entirely
+            uri = f'{pathlib.Path(db_path).absolute().as_uri()}?mode=ro&immutable=1'
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
             logging.info(f'Successfully connected to {db_path}')
-        except sqlite3.Error as e:
+        except (sqlite3.Error, OSError) as e:
             print(f"Error connecting to database: {e}")
+            self.close()
+
+
+    def close(self):
+        '''Closes database connection and removes snapshot copy if one was made.'''
+        if getattr(self, 'conn', None) is not None:
+            self.conn.close()
             self.conn = None
+        if getattr(self, '_snapshot_dir', None) is not None:
+            shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+            self._snapshot_dir = None
 
 
-    def query_local_zotero(self, collection_name:str) -> list:
-        '''Sends query to local Zotero sqlite database to get file names for locally available full texts for collection and its subcollections.'''
-        if self.conn is not None:
+    def query_local_zotero(self, collection_name) -> list:
+        '''
+        Sends query to local Zotero sqlite database to get locally available full texts for collection(s) and their subcollections.
+        collection_name - single name or list of names, all collections are resolved in one query.
+        Returns list of (attachment key, file name) pairs - attachment key is the name of the storage folder of the file.
+        Connection stays open for further queries - call close() when done.
+        '''
+        self.attachments = None
+        collection_names = [collection_name] if isinstance(collection_name, str) else list(collection_name)
+        if getattr(self, 'conn', None) is not None:
             cursor = self.conn.cursor()
-
-            #
+            placeholders = ', '.join('?' for _ in collection_names)
             query = f'''
                 WITH RECURSIVE subcollections(collectionID) AS (
-                SELECT collectionID FROM collections WHERE collectionName = '{collection_name}'
-                UNION ALL
+                SELECT collectionID FROM collections WHERE collectionName IN ({placeholders})
+                UNION
                 SELECT c.collectionID FROM collections c JOIN subcollections sc ON c.parentCollectionID = sc.collectionID
                 )
-                SELECT ia.path AS attachmentKey
+                SELECT DISTINCT ai.key AS storageKey, ia.path AS attachmentPath
                 FROM itemAttachments ia
+                JOIN items ai ON ia.itemID = ai.itemID
                 JOIN items i ON ia.parentItemID = i.itemID
                 JOIN collectionItems ci ON i.itemID = ci.itemID
                 WHERE ci.collectionID IN (SELECT collectionID FROM subcollections) AND ia.contentType = 'application/pdf';
             '''
+            failed = False
             try:
-                cursor.execute(query)
+                cursor.execute(query, collection_names)
                 items = cursor.fetchall()
-                self.pdf_names = set()
+                self.attachments = set()
                 for item in items:
                     try:
-                        if item[0] is not None:
-                            self.pdf_names.add(item[0].replace('storage:',''))
+                        if item[1] is not None:
+                            self.attachments.add((item[0], item[1].replace('storage:','')))
                     except Exception as e:
                         logging.error(f'Failed to extract name from {item} - {e}')
-                self.pdf_names = list(self.pdf_names)
-                logging.info(f'Successfully extracted file names for {collection_name}')
-                if len(self.pdf_names) == 0:
+                self.attachments = sorted(self.attachments)
+                self.pdf_names = [name for _, name in self.attachments]
+                logging.info(f'Successfully extracted file names for {", ".join(collection_names)}')
+                if len(self.attachments) == 0:
                     raise Exception(f'No documents were detected - aborting analysis - please verify that collection name was provided correctly: {collection_name}')
             except Exception as e:
                 logging.error(f"Error extracting pdf names: {e}")
-                sys.exit(2)
-                self.pdf_names = None
+                failed = True
             finally:
-                self.conn.close()
+                cursor.close()
+            if failed:
+                #cursor has to be closed before the connection
+                self.close()
+                sys.exit(2)
+        return self.attachments
 
 
-    def get_local_copies(self, save_path:str):
-        '''Copies locally-stored pdf files to save path.'''
-        if self.pdf_names is None:
+    def resolve_attachment(self, storage_key:str, file_name:str) -> str:
+        '''Path to locally stored attachment - storage/<attachment key>/<file name>, or file_name itself for linked files.'''
+        if os.path.isabs(file_name):
+            return file_name
+        return os.path.join(self._zotero_home, 'storage', storage_key, file_name)
+
+
+    def get_local_copies(self, save_path:str, mode:str='copy', max_workers:int=8):
+        '''
+        Copies locally-stored pdf files to save path.
+        mode - 'copy', 'hardlink' or 'symlink' - files can be linked instead of copied to save time and disk space.
+        '''
+        if getattr(self, 'attachments', None) is None:
             print('No files to copy.')
             return
-        else:
-            os.makedirs(save_path, exist_ok=True)
-            storage_path = os.path.join(self._zotero_home, 'storage/*/*.pdf')
-            for path in glob(storage_path):
-                pdf_name = os.path.basename(path)
-                if pdf_name in self.pdf_names:
-                    dest_path = os.path.join(save_path, pdf_name)
-                    print(path, dest_path)
-                    try:
-                        if not os.path.isfile(dest_path):
-                            shutil.copyfile(path, dest_path)
-                            logging.info(f'Successful copy - {path} to {dest_path}')
-                        else:
-                            logging.info(f'Skipping copy - {dest_path} exists')
-                    except Exception as e:
-                        logging.error(f'Failed to copy {pdf_name}: {e}')
+        os.makedirs(save_path, exist_ok=True)
+
+        def copy_file(storage_key, file_name):
+            path = self.resolve_attachment(storage_key, file_name)
+            dest_path = os.path.join(save_path, os.path.basename(file_name))
+            try:
+                if os.path.lexists(dest_path):
+                    logging.info(f'Skipping copy - {dest_path} exists')
+                elif not os.path.isfile(path):
+                    logging.warning(f'Attachment is not available locally - {path}')
+                elif mode == 'hardlink':
+                    os.link(path, dest_path)
+                elif mode == 'symlink':
+                    os.symlink(os.path.abspath(path), dest_path)
+                else:
+                    shutil.copyfile(path, dest_path)
+                    logging.info(f'Successful copy - {path} to {dest_path}')
+            except Exception as e:
+                logging.error(f'Failed to copy {file_name}: {e}')
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(copy_file, storage_key, file_name) for storage_key, file_name in self.attachments]
+        for future in futures:
+            future.result()
                 
 
 
 
+class ZoteroItemCache():
+    '''
+    Local SQLite cache of Zotero items keyed by item key and version, with collection membership.
+    '''
+    def __init__(self, path:str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS items (item_key TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS collection_items (collection_key TEXT NOT NULL, item_key TEXT NOT NULL, PRIMARY KEY (collection_key, item_key));
+        ''')
+
+
+    def stale_keys(self, versions:dict) -> list:
+        '''Returns keys of items which are missing from cache or cached with a different version.'''
+        cached = dict(self.conn.execute('SELECT item_key, version FROM items'))
+        return [key for key, version in versions.items() if cached.get(key) != version]
+
+
+    def update_items(self, items:list) -> None:
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO items (item_key, version, data) VALUES (?, ?, ?)',
+                [(item['key'], item['version'], json.dumps(item)) for item in items]
+                )
+
+
+    def update_membership(self, collection_key:str, item_keys) -> None:
+        '''Replaces list of items belonging to collection.'''
+        with self.conn:
+            self.conn.execute('DELETE FROM collection_items WHERE collection_key = ?', (collection_key,))
+            self.conn.executemany(
+                'INSERT INTO collection_items (collection_key, item_key) VALUES (?, ?)',
+                [(collection_key, key) for key in item_keys]
+                )
+
+
+    def collection_items(self, collection_keys:list) -> list:
+        '''Returns cached items (without duplicates) belonging to any of collection_keys.'''
+        placeholders = ','.join('?' * len(collection_keys))
+        rows = self.conn.execute(
+            f'''SELECT DISTINCT i.data FROM items i JOIN collection_items ci ON i.item_key = ci.item_key 
+                WHERE ci.collection_key IN ({placeholders})''',
+            list(collection_keys)
+            )
+        return [json.loads(data) for data, in rows]
+
+
+    def close(self) -> None:
+        self.conn.close()
+
+
 class ExternalLibConnector():
     '''
     Toolkit class with methods for connecting and data retrieval from different scientific publication sources.
@@ -281,6 +644,7 @@ class ExternalLibConnector():
     @staticmethod
     def connect_zotero(library_id, library_type, api_key):
         '''Get zotero connection object, ref. https://pyzotero.readthedocs.io/en/latest/'''
+        from pyzotero import zotero
         try:
             zot = zotero.Zotero(library_id, library_type, api_key)
             logging.info(f'Successfully established connection to Zotero library: {library_id}')
@@ -344,34 +708,47 @@ class ExternalLibConnector():
 
 
     @staticmethod
-    def get_items_zotero(zotero_connection, colname_colid_map: dict, max_workers:int=6) -> list:
+    def get_items_zotero(zotero_connection, colname_colid_map: dict, max_workers:int=6, cache_path:str=ZOTERO_CACHE_PATH, page_size:int=50) -> list:
         '''
-        Method to extract all items from all collections in the colname_colid_map
+        Method to extract all items from all collections in the colname_colid_map.
+        colname_colid_map already contains every (sub)collection to parse, so each collection is requested once.
+        Item versions of each collection are compared with local SQLite cache and only new or changed items 
+        are fetched, in pages of page_size item keys requested concurrently.
         '''
-        result = []
-        def fetch_collection_items(zotero_connection, collection_id):
-            '''Recursively extract items from collection and subcollection'''
-            items = zotero_connection.collection_items(collection_id)
-                
-            # Get subcollections of the current collection
-            subcollections = zotero_connection.collections_sub(collection_id)
-
-            # Recursively fetch items from subcollections
-            for subcollection in subcollections:
-                subcollection_id = subcollection['key']
-                subcollection_items = fetch_collection_items(zotero_connection, subcollection_id)
-                items.extend(subcollection_items)
+        if colname_colid_map is None:
+            return None
+        cache = ZoteroItemCache(cache_path)
+        local = threading.local()
 
-            return items
+        def client():
+            '''pyzotero client keeps request state in the object - one shallow copy per worker thread'''
+            if not hasattr(local, 'client'):
+                local.client = copy.copy(zotero_connection)
+            return local.client
 
-        if not colname_colid_map is None:
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [executor.submit(fetch_collection_items, zotero_connection, collection_id) for collection_id in colname_colid_map.values()]
+        def fetch_versions(collection_id):
+            return collection_id, client().collection_items(collection_id, format='versions', limit=None)
 
-            for future in futures:
-                result+=future.result()
+        def fetch_page(item_keys):
+            return client().items(itemKey=','.join(item_keys), limit=len(item_keys))
 
-            return result
+        collection_ids = list(dict.fromkeys(colname_colid_map.values()))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            versions = dict(executor.map(fetch_versions, collection_ids))
+            all_versions = {}
+            for collection_versions in versions.values():
+                all_versions.update(collection_versions)
+            stale = cache.stale_keys(all_versions)
+            pages = [stale[i:i + page_size] for i in range(0, len(stale), page_size)]
+            fetched = list(itertools.chain.from_iterable(executor.map(fetch_page, pages)))
+
+        cache.update_items(fetched)
+        for collection_id, collection_versions in versions.items():
+            cache.update_membership(collection_id, collection_versions.keys())
+        logging.info(f'Fetched {len(fetched)} new or changed items from Zotero, {len(all_versions) - len(stale)} items loaded from cache.')
+        result = cache.collection_items(collection_ids)
+        cache.close()
+        return result
 
     @staticmethod
     def get_pdf_urls_zotero(items:list, backup:bool=True, col_name:str="pdf_url_map", force_run=False) -> list:
@@ -403,43 +780,62 @@ class ExternalLibConnector():
         
 
     @staticmethod
-    def download_files(save_path:str, name_url_dict:dict, max_workers:int=6, filters=host_filters, force_run=False):
+    def download_file(url:str, name:str, save_path:str, engine, filters=host_filters, force_run=False) -> str:
         '''
-        Method to download files given list of urls, using requests library
-        filters - databases that only allow API-based downloads
+        Downloads single file with the downloader matching its host,
+        returns path to the file if it is available in save_path after the call, None otherwise.
         '''
-        os.makedirs(save_path, exist_ok=True)
-        download_counter = 0
-        def dwnld_file(url, name, save_path, force_run=force_run):
-            if not os.path.isfile(os.path.join(save_path, name)) or force_run:
-                filter_scan = [f in url for f in filters]
-                if not any(filter_scan):
-                    if 'ncbi.nlm.nih.gov' in url or 'researchgate.net' in url:
-                        download_ncbi_researchgate(url=url, save_path=save_path, name=name)
-                    elif 'arxiv.org' in url:
-                        download_arxiv(url=url, save_path=save_path, name=name)
-                    else:
-                        response = requests.get(url)
-                        if response.status_code == 200:
-                            content = response.content
-                            with open(os.path.join(save_path, name), 'wb') as outfile:
-                                    outfile.write(content)
-                            download_counter += 1
-                            logging.info(f'Succesfully downloaded file - status code: {response.status_code}\nURL: {url}\nName:{name}\nLocation: {save_path}')
-                        else:
-                            logging.error(f'Failed to download file - status code: {response.status_code}\nURL: {url}\nName:{name}')
+        file_path = os.path.join(save_path, name)
+        if not os.path.isfile(file_path) or force_run:
+            filter_scan = [f in url for f in filters]
+            if not any(filter_scan):
+                if 'ncbi.nlm.nih.gov' in url or 'researchgate.net' in url:
+                    download_ncbi_researchgate(url=url, save_path=save_path, name=name, engine=engine)
+                elif 'arxiv.org' in url:
+                    download_arxiv(url=url, save_path=save_path, name=name, engine=engine)
                 else:
-                    for i, _ in enumerate(filter_scan):
-                        if filter_scan[i]:
-                            logging.info(f'Failed to download file - host in filter list: {url} :: {filters[i]}')
+                    engine.fetch(url, file_path)
             else:
-                logging.info(f'Skipping download for {url} - file exists in {os.path.join(save_path, name)}')
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            [executor.submit(dwnld_file, url, name, save_path) for name, url in name_url_dict.items()]
-            logging.info(f'Succesfully downloaded {download_counter} files')
-
+                for i, _ in enumerate(filter_scan):
+                    if filter_scan[i]:
+                        logging.info(f'Failed to download file - host in filter list: {url} :: {filters[i]}')
+                engine.record('skipped')
+                return None
+        else:
+            logging.info(f'Skipping download for {url} - file exists in {file_path}')
+            engine.record('skipped')
+        return file_path if os.path.isfile(file_path) else None
 
 
+    @staticmethod
+    def get_download_engine():
+        '''DownloadEngine configured with settings from config.py'''
+        return DownloadEngine(
+            per_host_limit=download_per_host_limit, 
+            timeout=download_timeout, 
+            retries=download_retries, 
+            backoff=download_backoff
+            )
 
 
+    @staticmethod
+    def download_files(save_path:str, name_url_dict:dict, max_workers:int=6, filters=host_filters, force_run=False, engine=None):
+        '''
+        Method to download files given list of urls, using requests library
+        filters - databases that only allow API-based downloads
+        engine - DownloadEngine with pooled sessions, retries and counters (created from config if not provided)
+        '''
+        os.makedirs(save_path, exist_ok=True)
+        if engine is None:
+            engine = ExternalLibConnector.get_download_engine()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(ExternalLibConnector.download_file, url, name, save_path, engine, filters, force_run) for name, url in name_url_dict.items()]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f'Download worker failed - {e}')
+        stats = engine.summary(wall_time=time.perf_counter() - start)
+        logging.info(f"Succesfully downloaded {stats['succeeded']} files ({stats['failed']} failed, {stats['skipped']} skipped, {stats['throughput_mb_s']} MB/s)")
+        return stats
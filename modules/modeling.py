@@ -1,11 +1,12 @@
-import gensim.models
 import pickle 
-import pyLDAvis
-import pyLDAvis.gensim
+import hashlib
 import os
-import sys
+import time
 import logging
 
+from concurrent.futures import ProcessPoolExecutor
+from .utils import file_hash
+
 
 
 '''
@@ -25,43 +26,190 @@ class LatentDirichletAllocation():
     '''LDA-related toolkit class'''
 
     @staticmethod
-    def get_lda_model(corpus, vocab, num_topics):
-        '''Wrapper for gensim.models.Lda to obtain the model trained to detect num_topics from corpus of documents'''
-        return gensim.models.LdaMulticore(corpus=corpus,
-                                       id2word=vocab,
-                                       num_topics=num_topics)
+    def get_lda_model(corpus, vocab, num_topics, workers:int=None, chunksize:int=2000, passes:int=1, iterations:int=50, eval_every:int=0, multicore:bool=True):
+        '''
+        Wrapper for gensim.models.Lda to obtain the model trained to detect num_topics from corpus of documents.
+        corpus - streamed corpus (e.g. gensim MmCorpus) is read from disk once per pass.
+        multicore - False to train single-process LdaModel (workers is ignored), e.g. when several models are trained in parallel.
+        passes are run by gensim (same learning rate schedule as a single call), progress of each pass is logged by gensim.
+        eval_every - gensim eval_every, perplexity is estimated every n chunk updates, 0 - no perplexity estimates.
+        '''
+        import gensim.models
+        params = {
+            'corpus':corpus,
+            'id2word':vocab,
+            'num_topics':num_topics,
+            'chunksize':chunksize,
+            'passes':passes,
+            'iterations':iterations,
+            'eval_every':eval_every or None
+            }
+        start = time.perf_counter()
+        if multicore:
+            lda_model = gensim.models.LdaMulticore(workers=workers or None, **params)
+        else:
+            lda_model = gensim.models.LdaModel(**params)
+        logging.info(f'Trained LDA model with {num_topics} topics - {passes} passes in {time.perf_counter() - start:.2f} s')
+        return lda_model
     
 
     @staticmethod
     def load_lda_model(path):
-        return gensim.models.LdaMulticore.load(path)
+        import gensim.models
+        return gensim.models.LdaModel.load(path)
     
 
     @staticmethod
-    def visualize_lda_model(model, corpus, vocab, output_path):
-        # Visualize the topics
-        # # this is a bit time consuming - make the if statement True
-        # # if you want to execute visualization prep yourself
-        if not os.path.isfile(output_path):
-            try:
-                LDAvis_prepared = pyLDAvis.gensim.prepare(model, corpus, vocab)
-            except Exception as e:
-                logging.error(f'Failed to visualize results for vanilla LDA - {e} - try adjusting number of topics')
-                sys.exit(2)
-            viz_path = os.path.abspath(os.path.join(output_path, 'phyloviz'))
-            os.makedirs(viz_path,exist_ok=True)
-            viz_path= os.path.join(viz_path, 'viz_' + str(model.num_topics) + '.pickle')
-            with open(viz_path, 'wb') as f:
-                pickle.dump(LDAvis_prepared, f)
-            pyLDAvis.save_html(LDAvis_prepared, os.path.join(output_path,str(model.num_topics) +'.html'))
+    def visualization_key(model, corpus, sort_topics:bool=True, corpus_hash:str=None) -> str:
+        '''
+        Cache key of prepared pyLDAvis data - hash of topic-term matrix of the model, corpus and topic ordering.
+        corpus_hash - precomputed hash of the corpus (e.g. of Matrix Market file), corpus is hashed document by document otherwise.
+        '''
+        digest = hashlib.sha256(model.get_topics().tobytes())
+        if corpus_hash is None:
+            corpus_digest = hashlib.sha256()
+            for doc in corpus:
+                corpus_digest.update(repr(doc).encode('utf-8'))
+            corpus_hash = corpus_digest.hexdigest()
+        digest.update(f'{corpus_hash}|{sort_topics}'.encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+
+    @staticmethod
+    def visualize_lda_model(model, corpus, vocab, output_path, n_jobs:int=-1, sort_topics:bool=True, corpus_hash:str=None) -> bool:
+        '''
+        Saves pyLDAvis visualization of the model to output_path/<num_topics>.html.
+        Prepared data is pickled to output_path/phyloviz/ keyed by model and corpus hash and reused by later runs.
+        n_jobs, sort_topics - passed to pyLDAvis prepare, sort_topics=False skips reordering topics by size.
+        Returns False if visualization failed.
+        '''
+        import pyLDAvis
+        import pyLDAvis.gensim
+        key = LatentDirichletAllocation.visualization_key(model, corpus, sort_topics=sort_topics, corpus_hash=corpus_hash)
+        viz_path = os.path.abspath(os.path.join(output_path, 'phyloviz'))
+        os.makedirs(viz_path,exist_ok=True)
+        viz_path = os.path.join(viz_path, f'viz_{model.num_topics}_{key}.pickle')
+        html_path = os.path.join(output_path, f'{model.num_topics}.html')
+        try:
+            if os.path.isfile(viz_path):
+                logging.info(f'Reusing prepared visualization data - {viz_path}')
+                with open(viz_path, 'rb') as f:
+                    LDAvis_prepared = pickle.load(f)
+            else:
+                LDAvis_prepared = pyLDAvis.gensim.prepare(model, corpus, vocab, n_jobs=n_jobs, sort_topics=sort_topics)
+                with open(viz_path, 'wb') as f:
+                    pickle.dump(LDAvis_prepared, f)
+            pyLDAvis.save_html(LDAvis_prepared, html_path)
+            return True
+        except Exception as e:
+            logging.error(f'Failed to visualize results for vanilla LDA - {e} - try adjusting number of topics')
+            return False
+
+
+    @staticmethod
+    def visualize_saved_model(model_path:str, corpus_path:str, vocab, output_path:str, n_jobs:int=-1, sort_topics:bool=True) -> bool:
+        '''Visualizes model and Matrix Market corpus saved on disk - used as LDAVisualizer worker.'''
+        from gensim.corpora import MmCorpus
+        return LatentDirichletAllocation.visualize_lda_model(
+            model=LatentDirichletAllocation.load_lda_model(model_path), 
+            corpus=MmCorpus(corpus_path), 
+            vocab=vocab, 
+            output_path=output_path, 
+            n_jobs=n_jobs, 
+            sort_topics=sort_topics,
+            corpus_hash=file_hash(corpus_path)
+            )
 
     
     @staticmethod
-    def run_default_gensim_lda(corpus:list, vocab, model_path:str, num_topics:int=3, visualize_lda=True, visual_path:str=None):
+    def run_default_gensim_lda(corpus, vocab, model_path:str, num_topics:int=3, visualize_lda=True, visual_path:str=None, training_params:dict={}):
+        '''training_params - keyword arguments of get_lda_model (workers, chunksize, passes, iterations, eval_every)'''
         if not os.path.isfile(model_path):
-            lda_model   = LatentDirichletAllocation.get_lda_model(corpus=corpus, vocab=vocab, num_topics=num_topics)
+            lda_model   = LatentDirichletAllocation.get_lda_model(corpus=corpus, vocab=vocab, num_topics=num_topics, **training_params)
             lda_model.save(model_path)
         else:
             lda_model = LatentDirichletAllocation.load_lda_model(model_path)
         if visualize_lda:
             LatentDirichletAllocation.visualize_lda_model(model=lda_model, corpus = corpus, vocab=vocab, output_path=visual_path)
+        return lda_model
+
+
+    @staticmethod
+    def train_sweep_model(corpus_path:str, vocab, num_topics:int, model_path:str, training_params:dict={}) -> dict:
+        '''
+        Sweep worker - trains single-process LDA model for num_topics (or loads it from model_path),
+        returns training time and u_mass coherence of the model.
+        '''
+        from gensim.corpora import MmCorpus
+        from gensim.models import CoherenceModel
+        corpus = MmCorpus(corpus_path)
+        cached = os.path.isfile(model_path)
+        start = time.perf_counter()
+        if cached:
+            lda_model = LatentDirichletAllocation.load_lda_model(model_path)
+        else:
+            lda_model = LatentDirichletAllocation.get_lda_model(corpus=corpus, vocab=vocab, num_topics=num_topics, multicore=False, **training_params)
+            lda_model.save(model_path)
+        training_time = time.perf_counter() - start
+        coherence = CoherenceModel(model=lda_model, corpus=corpus, dictionary=vocab, coherence='u_mass').get_coherence()
+        return {
+            'num_topics':num_topics,
+            'coherence_u_mass':coherence,
+            'training_seconds':0.0 if cached else round(training_time, 2),
+            'cached':cached,
+            'model_path':model_path
+            }
+
+
+    @staticmethod
+    def sweep_gensim_lda(corpus_path:str, vocab, model_paths:dict, summary_path:str, max_workers:int=None, training_params:dict={}):
+        '''
+        Topic-count sweep - trains one model per number of topics concurrently in a process pool (one single-process model per worker).
+        model_paths - maps number of topics to model path, existing models are loaded instead of retrained.
+        Writes table with coherence and training time of each model to summary_path and returns it as a list of dicts.
+        '''
+        import pandas as pd
+        topic_counts = sorted(model_paths)
+        max_workers = min(len(topic_counts), max_workers or os.cpu_count() or 1)
+        logging.info(f'Training LDA models for {len(topic_counts)} topic counts using {max_workers} processes.')
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(LatentDirichletAllocation.train_sweep_model, corpus_path, vocab, num_topics, model_paths[num_topics], training_params) for num_topics in topic_counts]
+            summary = [future.result() for future in futures]
+        pd.DataFrame(summary).to_csv(summary_path, index=False)
+        for row in summary:
+            logging.info(f"{row['num_topics']} topics - u_mass coherence: {row['coherence_u_mass']:.3f} - training time: {row['training_seconds']} s")
+        return summary
+
+
+
+class LDAVisualizer():
+    '''
+    Optional asynchronous visualization stage - pyLDAvis data for saved models is prepared in background processes,
+    so that training of following models is not blocked. workers=0 prepares visualizations synchronously.
+    '''
+    def __init__(self, workers:int=1, n_jobs:int=-1, sort_topics:bool=True):
+        self.n_jobs = n_jobs
+        self.sort_topics = sort_topics
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._pending = []
+
+
+    def submit(self, model_path:str, corpus_path:str, vocab, output_path:str) -> None:
+        '''Schedules visualization of model saved in model_path.'''
+        args = (model_path, corpus_path, vocab, output_path, self.n_jobs, self.sort_topics)
+        if self._executor is None:
+            LatentDirichletAllocation.visualize_saved_model(*args)
+        else:
+            self._pending.append((output_path, self._executor.submit(LatentDirichletAllocation.visualize_saved_model, *args)))
+
+
+    def close(self) -> None:
+        '''Waits for scheduled visualizations to finish.'''
+        for output_path, future in self._pending:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f'Visualization worker failed for {output_path} - {e}')
+        self._pending = []
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from glob import glob
+from .config import host_filters
+from .input_parsing import ExternalLibConnector, TextParser
+from .preprocessing import PreProcessor
+
+
+##############################
+#Overlapping download pipeline
+##############################
+
+class AsyncPipeline():
+    '''
+    Asyncio producer/consumer pipeline that overlaps downloading with text extraction and preprocessing.
+    Downloaded files go straight to extraction and then to preprocessing through bounded queues (backpressure),
+    every stage has its own concurrency cap. Results are yielded as {'name', 'result'} dicts in completion order.
+    '''
+    _DONE = object()
+
+    def __init__(
+        self, 
+        save_path:str, 
+        name_url_dict:dict, 
+        image_path:str=None,
+        preprocess_kwargs:dict={},
+        download_workers:int=6, 
+        extraction_workers:int=2, 
+        preprocessing_workers:int=2, 
+        queue_size:int=8,
+        extraction_timeout:float=None,
+        filters=host_filters, 
+        force_run=False, 
+        engine=None,
+        skip=None
+        ):
+        self.save_path = save_path
+        self.name_url_dict = name_url_dict
+        self.image_path = image_path
+        self.preprocess_kwargs = preprocess_kwargs
+        self.download_workers = download_workers
+        self.extraction_workers = extraction_workers
+        self.preprocessing_workers = preprocessing_workers
+        self.queue_size = queue_size
+        self.extraction_timeout = extraction_timeout
+        self.filters = filters
+        self.force_run = force_run
+        self.engine = engine or ExternalLibConnector.get_download_engine()
+        self.skip = skip
+
+
+    async def _download_stage(self, executor, extract_queue:asyncio.Queue) -> None:
+        '''Producer - downloads files concurrently and passes paths of available files to extraction.'''
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.download_workers)
+        queued = set()
+
+        async def download(name, url):
+            async with limit:
+                try:
+                    path = await loop.run_in_executor(
+                        executor, ExternalLibConnector.download_file, url, name, self.save_path, self.engine, self.filters, self.force_run
+                        )
+                except Exception as e:
+                    #single failed download must not abort the pipeline (as in ExternalLibConnector.download_files)
+                    logging.error(f'Download worker failed - {e}\nURL: {url}')
+                    self.engine.record('failed')
+                    return
+            if path is not None and path not in queued:
+                queued.add(path)
+                await extract_queue.put(path)
+
+        await asyncio.gather(*[download(name, url) for name, url in self.name_url_dict.items()])
+        #files already present in save_path that are not part of the download list
+        for path in glob(os.path.join(self.save_path, '*.pdf')):
+            if path not in queued:
+                queued.add(path)
+                await extract_queue.put(path)
+        for _ in range(self.extraction_workers):
+            await extract_queue.put(AsyncPipeline._DONE)
+
+
+    async def _extraction_stage(self, executor, extract_queue:asyncio.Queue, preprocess_queue:asyncio.Queue) -> None:
+        '''Consumer of downloaded paths, producer of extracted texts.'''
+        loop = asyncio.get_running_loop()
+        while True:
+            path = await extract_queue.get()
+            if path is AsyncPipeline._DONE:
+                break
+            #skip check hashes the whole file (TokenCache.contains) - it must not block the event loop
+            if self.skip is not None and await loop.run_in_executor(None, self.skip, path):
+                await preprocess_queue.put({'name':path, 'text':None})
+                continue
+            pdf = await loop.run_in_executor(executor, TextParser.read_pdf_with_timeout, path, self.extraction_timeout)
+            if pdf is not None:
+                await preprocess_queue.put(pdf)
+
+
+    async def _preprocessing_stage(self, executor, preprocess_queue:asyncio.Queue, output_queue:queue.Queue) -> None:
+        '''Consumer of extracted texts, puts preprocessed documents to output queue.'''
+        loop = asyncio.get_running_loop()
+        while True:
+            pdf = await preprocess_queue.get()
+            if pdf is AsyncPipeline._DONE:
+                break
+            try:
+                result = await loop.run_in_executor(executor, partial(
+                    PreProcessor.preprocess_document, pdf['text'], pdf['name'], image_path=self.image_path, **self.preprocess_kwargs
+                    ))
+            except Exception as e:
+                logging.error(f"Failed to preprocess {pdf['name']} - {e}")
+                continue
+            #blocking put is executed in thread, so that slow consumer pauses the pipeline without blocking the loop
+            await loop.run_in_executor(None, output_queue.put, {'name':pdf['name'], 'result':result})
+
+
+    async def run(self, output_queue:queue.Queue) -> None:
+        '''Runs all stages until every file is downloaded, extracted and preprocessed.'''
+        os.makedirs(self.save_path, exist_ok=True)
+        if self.image_path is not None:
+            os.makedirs(self.image_path, exist_ok=True)
+        extract_queue = asyncio.Queue(maxsize=self.queue_size)
+        preprocess_queue = asyncio.Queue(maxsize=self.queue_size)
+        with ThreadPoolExecutor(max_workers=self.download_workers) as download_executor, \
+             ProcessPoolExecutor(max_workers=self.extraction_workers) as extraction_executor, \
+             ProcessPoolExecutor(
+                max_workers=self.preprocessing_workers, 
+                initializer=PreProcessor.init_worker, 
+                initargs=(
+                    self.preprocess_kwargs.get('stemming_alg', 'Porter'), 
+                    self.preprocess_kwargs.get('ext_stopword_list', []), 
+                    self.preprocess_kwargs.get('tokenizer', 'nltk')
+                    )
+                ) as preprocessing_executor:
+            extractors = [
+                asyncio.create_task(self._extraction_stage(extraction_executor, extract_queue, preprocess_queue)) 
+                for _ in range(self.extraction_workers)
+                ]
+            preprocessors = [
+                asyncio.create_task(self._preprocessing_stage(preprocessing_executor, preprocess_queue, output_queue)) 
+                for _ in range(self.preprocessing_workers)
+                ]
+            await self._download_stage(download_executor, extract_queue)
+            await asyncio.gather(*extractors)
+            for _ in range(self.preprocessing_workers):
+                await preprocess_queue.put(AsyncPipeline._DONE)
+            await asyncio.gather(*preprocessors)
+        stats = self.engine.summary()
+        logging.info(f"Succesfully downloaded {stats['succeeded']} files ({stats['failed']} failed, {stats['skipped']} skipped)")
+
+
+    def generator(self):
+        '''Runs the pipeline in background thread and yields preprocessed documents as soon as they are ready.'''
+        output_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+
+        def run_loop():
+            try:
+                asyncio.run(self.run(output_queue))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                output_queue.put(AsyncPipeline._DONE)
+
+        thread = threading.Thread(target=run_loop, daemon=True)
+        thread.start()
+        while True:
+            item = output_queue.get()
+            if item is AsyncPipeline._DONE:
+                break
+            yield item
+        thread.join()
+        if errors:
+            raise errors[0]
@@ -1,21 +1,24 @@
 import logging 
 import re
-import nltk
 import concurrent.futures
-import gensim.corpora as corpora
 import os
-import pandas as pd
 import itertools
+import hashlib
+import json
+import time
+import zlib
+import shutil
+import gzip
+import uuid
+import numpy as np
 
-from collections import Counter
-from spacy.tokenizer import Tokenizer
-from spacy.lang.en import English
-from nltk.stem import *
-from nltk.corpus import stopwords
-from nltk.util import ngrams
-from wordcloud import WordCloud
-from matplotlib import pyplot as plt
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from glob import glob
+from .input_parsing import TextParser
+from .utils import file_hash
+from .config import token_score_cache_size, spacy_batch_size, plot_queue_size, vw_compact, vw_compression
 
 #######################
 #General configurations
@@ -25,6 +28,142 @@ logging.basicConfig(level=2)
 # nltk.download('punkt')
 # nltk.download('stopwords')
 
+##############
+#Token quality
+##############
+
+class TokenQuality():
+    '''
+    Toolkit class with memoized token-shape scores used to detect gibberish tokens.
+    Scores are cached per process with bounded LRU caches keyed by token.
+    '''
+    @staticmethod
+    @lru_cache(maxsize=token_score_cache_size)
+    def max_dimer_freq(token:str) -> float:
+        '''Dimer frequency scan to detect words made from single character and words of 2 characters'''
+        if len(token) < 2:
+            return 0.0
+        #counting overlapping dimers in a single pass
+        dimer_counts = Counter(token[i:i+2] for i in range(len(token)-1))
+        return round(max(dimer_counts.values())/len(token),1)
+
+
+    @staticmethod
+    @lru_cache(maxsize=token_score_cache_size)
+    def max_char_freq(token:str) -> int:
+        '''Number of occurrences of the most frequent character in token'''
+        if not token:
+            return 0
+        return max(Counter(token).values())
+
+
+    @staticmethod
+    def cache_info() -> dict:
+        '''Returns hit/miss statistics of token score caches in current process.'''
+        return {
+            'max_dimer_freq':TokenQuality.max_dimer_freq.cache_info()._asdict(),
+            'max_char_freq':TokenQuality.max_char_freq.cache_info()._asdict()
+            }
+
+
+    @staticmethod
+    def cache_clear() -> None:
+        '''Clears token score caches in current process.'''
+        TokenQuality.max_dimer_freq.cache_clear()
+        TokenQuality.max_char_freq.cache_clear()
+
+
+    @staticmethod
+    def max_run_length(codes:np.ndarray) -> np.ndarray:
+        '''Length of the longest run of equal non-zero values in each row of row-sorted array.'''
+        run = (codes[:, 0] != 0).astype(np.int64)
+        best = run.copy()
+        for j in range(1, codes.shape[1]):
+            valid = codes[:, j] != 0
+            run = np.where(valid & (codes[:, j] == codes[:, j-1]), run + 1, valid.astype(np.int64))
+            np.maximum(best, run, out=best)
+        return best
+
+
+    @staticmethod
+    def shape_features(terms, chunk_size:int=2**16) -> dict:
+        '''
+        Vectorized token-shape scores for array of unique terms, same values as len, max_char_freq and max_dimer_freq.
+        Terms are converted to fixed-width arrays of character codes and processed in chunks of chunk_size terms.
+        '''
+        terms = np.asarray(terms, dtype=str)
+        token_len = np.zeros(len(terms), dtype=np.int64)
+        max_char_count = np.zeros(len(terms), dtype=np.int64)
+        max_dimer_count = np.zeros(len(terms), dtype=np.int64)
+        for start in range(0, len(terms), chunk_size):
+            chunk = terms[start:start + chunk_size]
+            width = max(chunk.dtype.itemsize // 4, 1)
+            chars = np.ascontiguousarray(chunk, dtype=f'<U{width}').view(np.uint32).reshape(len(chunk), width).astype(np.uint64)
+            end = start + len(chunk)
+            token_len[start:end] = (chars != 0).sum(axis=1)
+            max_char_count[start:end] = TokenQuality.max_run_length(np.sort(chars, axis=1))
+            if width > 1:
+                #dimers encoded as single integers - 21 bits per unicode code point, dimers reaching into padding are zeroed
+                dimers = np.where(chars[:, 1:] != 0, (chars[:, :-1] << np.uint64(21)) | chars[:, 1:], 0)
+                max_dimer_count[start:end] = TokenQuality.max_run_length(np.sort(dimers, axis=1))
+        #rounding with python round on unique (count, length) pairs keeps values identical to max_dimer_freq
+        pairs, inverse = np.unique(np.stack([max_dimer_count, token_len], axis=1), axis=0, return_inverse=True)
+        rounded = np.array([round(count/length, 1) if length >= 2 else 0.0 for count, length in pairs], dtype=np.float64)
+        return {
+            'token_len':token_len,
+            'max_char_count':max_char_count,
+            'max_dimer_freq':rounded[inverse.reshape(-1)] if len(pairs) else np.zeros(0)
+            }
+
+
+###################
+#Tokenizer backends
+###################
+
+class TokenizerBackend():
+    '''
+    Toolkit class wrapping supported tokenizers - 'nltk' and 'spacy'.
+    Each tokenizer is built once per process and reused for all pages and documents.
+    '''
+    PUNCT_SPACING = re.compile(r'([,.!?])([^\s])')
+    MULTI_SPACE = re.compile(r'\s{2,}')
+    SUPPORTED = ('nltk', 'spacy')
+
+    @staticmethod
+    def normalize(text:str) -> str:
+        '''Inserts missing space after punctuation and collapses repeated whitespace.'''
+        return TokenizerBackend.MULTI_SPACE.sub(' ', TokenizerBackend.PUNCT_SPACING.sub(r'\1 \2', text))
+
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_spacy():
+        '''Returns blank English spaCy pipeline (tokenizer only).'''
+        from spacy.lang.en import English
+        return English()
+
+
+    @staticmethod
+    def warm_up(tokenizer:str='nltk') -> None:
+        '''Builds tokenizer in current process, e.g. in process pool initializer.'''
+        TokenizerBackend.tokenize_pages(['warm up'], tokenizer=tokenizer)
+
+
+    @staticmethod
+    def tokenize_pages(pages:list, tokenizer:str='nltk', batch_size:int=spacy_batch_size) -> list:
+        '''
+        Tokenizes list of (normalized) page texts, returns list of token lists in the same order.
+        spaCy pages are processed in batches of batch_size with nlp.pipe.
+        '''
+        if tokenizer == 'spacy':
+            nlp = TokenizerBackend.get_spacy()
+            return [[token.text for token in doc] for doc in nlp.pipe(pages, batch_size=batch_size)]
+        if tokenizer != 'nltk':
+            logging.warning(f'Unrecognized tokenizer - {tokenizer} - using nltk.')
+        import nltk
+        return [nltk.word_tokenize(page) for page in pages]
+
+
 ###############
 #Pre-processing
 ###############
@@ -51,42 +190,40 @@ class PreProcessor():
         Given a document, represented as dictionary where page number is mapped to text,
         removes punctuation and converts all leters to lowercase.
         '''
-
-        def max_dimer_freq(string):
-                '''Dimer frequency scan to detect words made from single character and words of 2 characters'''
-                max_freq = 0
-                for i in range(len(string)-1):
-                    dimer = string[i:i+2]
-                    #counting overlapping dimers
-                    count = len(re.findall(f'(?={dimer})', string))
-                    if count > max_freq:
-                        max_freq = count
-                return round(max_freq/len(string),1)
-        for k in pdf_dict:
-            pdf_dict[k] = re.sub(r'([,.!?])([^\s])', r'\1 \2', pdf_dict[k])
-            pdf_dict[k] = re.sub("\s{2,}", " ", pdf_dict[k])
-            if tokenizer == 'nltk':
-                pdf_dict[k] = nltk.word_tokenize(pdf_dict[k])
-                pdf_dict[k] = [word.lower() for word in pdf_dict[k] if word.isalpha() and max_dimer_freq(word.lower()) < 0.5]
-            elif tokenizer == 'spacy':
-                nlp = English()
-                tokenizer = nlp.tokenizer
-                pdf_dict[k] = tokenizer(pdf_dict[k])
-                pdf_dict[k] = [str(word).lower() for word in pdf_dict[k] if str(word).isalpha() and max_dimer_freq(word.lower()) < 0.5]
+        pages = [TokenizerBackend.normalize(pdf_dict[k]) for k in pdf_dict]
+        for k, tokens in zip(list(pdf_dict), TokenizerBackend.tokenize_pages(pages, tokenizer=tokenizer)):
+            pdf_dict[k] = [word.lower() for word in tokens if word.isalpha() and TokenQuality.max_dimer_freq(word.lower()) < 0.5]
         return pdf_dict
 
     
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_stemmer(algorithm:str='Porter'):
+        '''Returns nltk stemmer for the specified algorithm (built once per process), None if algorithm is not recognized.'''
+        from nltk.stem import PorterStemmer, SnowballStemmer
+        if algorithm == 'Porter':
+            return PorterStemmer()
+        elif algorithm == 'Snowball':
+            return SnowballStemmer('english')
+        return None
+
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_stop_words(extended_list:tuple=()) -> frozenset:
+        '''Returns set of lowercase english stopwords extended with extended_list (built once per process).'''
+        from nltk.corpus import stopwords
+        return frozenset([word.lower() for word in stopwords.words('english')] + [word.lower() for word in extended_list])
+
+
     @staticmethod
     def stemming(pdf_dict:dict, algorithm:str='Porter') -> dict:
         '''
         Given a document, represented as dictionary where page number is mapped to TOKENIZED text,
         applies stemming to the text with specified algorithm implemented in nltk.
         '''
-        if algorithm == 'Porter':
-            stemmer = PorterStemmer()
-        elif algorithm == 'Snowball':
-            stemmer = snowball.SnowballStemmer('english')
-        else:
+        stemmer = PreProcessor.get_stemmer(algorithm)
+        if stemmer is None:
             return pdf_dict
         
         for k in pdf_dict:
@@ -100,8 +237,7 @@ class PreProcessor():
         Given a document, represented as dictionary where page number is mapped to text,
         removes stopwords from the text.
         '''
-        stop_words = stopwords.words('english')
-        stop_words = set([word.lower() for word in stopwords.words('english')] + [word.lower() for word in extended_list])
+        stop_words = PreProcessor.get_stop_words(tuple(extended_list))
         for k in pdf_dict:
             pdf_dict[k] = [wd for wd in pdf_dict[k] if wd.lower() not in stop_words and len(wd) > 1]
         return pdf_dict
@@ -110,47 +246,121 @@ class PreProcessor():
     
 
     @staticmethod
-    def generate_ngrams(pdf_dict:dict, n:int=2, upper_th=950, lower_th=3) -> list:
+    def flatten_pages(pdf_dict:dict) -> list:
+        '''
+        Given a document, represented as dictionary where page number is mapped to TOKENIZED text,
+        returns a single list of tokens in page order (linear-time alternative to sum(pages, [])).
+        '''
+        return list(itertools.chain.from_iterable(pdf_dict.values()))
+
+
+    @staticmethod
+    def filter_by_frequency(tokens:list, upper_th=950, lower_th=3, counts:Counter=None) -> list:
+        '''
+        Keeps tokens whose frequency is strictly between lower_th and upper_th.
+        Frequencies are counted once in a single pass, unless precomputed counts are given
+        (e.g. collection-wide counts, see filter_corpus_by_frequency).
+        '''
+        if counts is None:
+            counts = Counter(tokens)
+        return [word for word in tokens if lower_th < counts[word] < upper_th]
+
+
+    @staticmethod
+    def filter_corpus_by_frequency(docs:list, upper_th=950, lower_th=3) -> list:
+        '''
+        Collection-wide frequency filter - thresholds are applied to token counts 
+        accross all documents instead of counts within each document.
+        docs - list of token lists or TokenCorpus (filtered TokenCorpus is returned).
+        '''
+        if isinstance(docs, TokenCorpus):
+            return docs.filter_by_frequency(upper_th=upper_th, lower_th=lower_th)
+        counts = Counter(itertools.chain.from_iterable(docs))
+        return [PreProcessor.filter_by_frequency(doc, upper_th=upper_th, lower_th=lower_th, counts=counts) for doc in docs]
+
+
+    @staticmethod
+    def generate_ngrams(pdf_dict:dict, n:int=2, upper_th=950, lower_th=3, freq_filter:str='document') -> list:
+        '''
+        Given a document, represented as dictionary where page number is mapped to TOKENIZED text,
+        returns a list of n-grams joined with "_".
+        freq_filter - 'document' to apply thresholds to counts within the document,
+                      'corpus' to skip filtering here and apply it later with filter_corpus_by_frequency.
+        '''
         if int(n) <=1:
-            return [word for word in sum(pdf_dict.values(), [])]
+            return PreProcessor.flatten_pages(pdf_dict)
+        from nltk.util import ngrams
         for k in pdf_dict:
             pdf_dict[k] = ["_".join(ngram) for ngram in ngrams([wd for wd in pdf_dict[k]], n) if len(set(ngram)) > 1]
 
-        #Filter words with frequency above threshold in the entire collection
-        collection = [word for word in sum(pdf_dict.values(), [])]
-        collection = [word for word in collection if collection.count(word) < upper_th and collection.count(word) > lower_th]
-        return collection
+        collection = PreProcessor.flatten_pages(pdf_dict)
+        if freq_filter == 'corpus':
+            return collection
+        return PreProcessor.filter_by_frequency(collection, upper_th=upper_th, lower_th=lower_th)
 
 
     @staticmethod
-    def save_corpus_to_vw(docs, names, output_path, file_name):
-        '''Saves the entire corpus in Vowpal Wabbit format to a specified file.'''
+    def save_corpus_to_vw(docs, names=None, output_path='.', file_name='model', compact:bool=vw_compact, compression:str=vw_compression) -> str:
+        '''
+        Saves the entire corpus in Vowpal Wabbit format to a specified file, returns path to the file.
+        docs - list of token lists or TokenCorpus (document names are taken from TokenCorpus if names are not given).
+        compact, compression - see VWWriter.
+        '''
+        if names is None:
+            names = docs.names
         logging.info('Saving dataset to Vowpal Wabbit file to be used with BigARTM.')
-        output = os.path.join(output_path, f'{file_name}_vw.txt')
-        with open(output, 'w') as vw_file:  # Use 'w' to overwrite or create a new file
+        output = VWWriter.file_path(output_path, file_name, compression)
+        with VWWriter(output, compact=compact, compression=compression) as vw_file:
             for idx, doc in enumerate(docs):
-                # Use the abstracted method to save each document
-                PreProcessor.save_document_to_vw(vw_file, names[idx], doc)
+                vw_file.write(names[idx], doc)
+        return output
 
 
     @staticmethod
-    def save_document_to_vw(vw_file, doc_name, doc):
-        '''Formats and writes a single document's bag of words to the VW format file.'''
-        # Assuming a default label of 1 for simplicity
-        vw_line = os.path.basename(doc_name).replace('.pdf', '').replace(' ', '_') # Format the document identifier
-        # Add word-frequency pairs, format as "word:frequency" if frequency > 1, else just "word"
-        if len(doc) > 0:
-            for wd in doc:
-                vw_line += f" {wd}"
-            # Write the formatted line to the VW file if it is not empty
-            vw_file.write(vw_line + "\n")
+    def vw_doc_id(doc_name) -> str:
+        '''Document identifier used in Vowpal Wabbit files.'''
+        return os.path.basename(doc_name).replace('.pdf', '').replace(' ', '_')
+
 
     @staticmethod
-    def get_cooc_vocab(docs, vocab, vocab_path, cooc_path, window=10)-> None:
-        '''Generates vocabulary and cooccurence files to use in artm'''
+    def save_document_to_vw(vw_file, doc_name, doc, compact:bool=False):
+        '''Formats and writes a single document's bag of words to the VW format file (empty documents are skipped).'''
+        line = VWWriter.format_line(doc_name, doc, compact=compact)
+        if line:
+            vw_file.write(line)
+
+    @staticmethod
+    def get_cooc_vocab(docs, vocab, vocab_path, cooc_path, window=10, engine='sparse')-> None:
+        '''
+        Generates vocabulary and cooccurence files to use in artm
+        docs - list of token lists or TokenCorpus
+        engine - 'sparse' to count co-occurrences with vectorized CoocMatrix, 'python' for pure python loops
+        '''
+        PreProcessor.save_vocab(vocab, vocab_path)
+        if engine == 'python':
+            PreProcessor.count_cooc_python(docs, vocab, cooc_path, window=window)
+            return
+        cooc = CoocMatrix(window=window, num_terms=len(vocab))
+        if isinstance(docs, TokenCorpus):
+            for token_ids in docs.iter_vocab_ids(vocab):
+                cooc.add(token_ids)
+        else:
+            for doc in docs:
+                cooc.add(np.fromiter((vocab.token2id[token] for token in doc if token in vocab.token2id), dtype=np.int64))
+        cooc.write(cooc_path)
+
+
+    @staticmethod
+    def save_vocab(vocab, vocab_path) -> None:
+        '''Writes vocabulary file - one word per line in the order of word ids.'''
         with open(vocab_path, 'w') as f:
             for _, word in vocab.iteritems():
                 f.write(word + '\n')
+
+
+    @staticmethod
+    def count_cooc_python(docs, vocab, cooc_path, window=10) -> None:
+        '''Reference implementation of co-occurrence counting with python loops.'''
         # Initialize a counter to hold co-occurrence counts.
         co_occurrences = Counter()
 
@@ -180,14 +390,21 @@ class PreProcessor():
         '''
         Given a generator for documents represented as dictionary where page number is mapped to text,
         returns a set of unique words accross all documents.
+        docs - iterable of token lists or TokenCorpus.
         '''
+        import gensim.corpora as corpora
         id2word = corpora.Dictionary(docs)
         return id2word
 
 
     @staticmethod
     def bow_generator(docs, vocab):
-        '''Generator wrapper to get BOW representation for articles'''
+        '''Generator wrapper to get BOW representation for articles, docs - iterable of token lists or TokenCorpus'''
+        if isinstance(docs, TokenCorpus):
+            for token_ids in docs.iter_vocab_ids(vocab):
+                ids, counts = np.unique(token_ids, return_counts=True)
+                yield list(zip(ids.tolist(), counts.tolist()))
+            return
         for doc in docs:
             yield PreProcessor.bag_of_words(doc, vocab)
 
@@ -202,18 +419,21 @@ class PreProcessor():
 
 
     @staticmethod
-    def plot_wordcloud(pdf_list:list, file_name:str='test') -> None:
+    def plot_wordcloud(pdf_list:list=[], file_name:str='test', frequencies:dict=None) -> None:
         '''
         Given a document, represented as dictionary where page number is mapped to text,
         plots wordcloud showing most frequent word accross the entire dictionary.
+        frequencies - precomputed term frequencies of the document, used instead of pdf_list.
         ''' 
         try:
             # Generate a word cloud
             logging.info(f'Generating wordcloud plot - {file_name}')
-            if pdf_list:
-                long_string = ','.join(pdf_list)
+            if frequencies is None:
+                frequencies = Counter(pdf_list)
+            if frequencies:
+                from wordcloud import WordCloud
                 wordcloud = WordCloud(background_color="white", max_words=5000, contour_width=3, contour_color='steelblue')
-                wordcloud.generate(long_string)
+                wordcloud.generate_from_frequencies(frequencies)
                 # Visualize the word cloud
                 wordcloud.to_file(file_name)
             else:
@@ -223,19 +443,22 @@ class PreProcessor():
 
 
     @staticmethod
-    def plot_tfplot(pdf_list:list=[], pdf_df=None, file_name:str='test', top:int=100, save_pdf:bool=True) -> None:
+    def plot_tfplot(pdf_list:list=[], pdf_df=None, file_name:str='test', top:int=100, save_pdf:bool=True, frequencies:dict=None) -> None:
         '''
         Given a document, represented as dictionary where page number is mapped to text,
         plots wordcloud showing most frequent word accross the entire dictionary.
+        frequencies - precomputed term frequencies of the document, used instead of pdf_list.
         ''' 
         logging.info(f'Generating term frequency plot - {file_name}')
+        import pandas as pd
+        from matplotlib import pyplot as plt
         try:
-            if pdf_list and not os.path.isfile(file_name):
+            if frequencies is None and pdf_list:
+                frequencies = Counter(pdf_list)
+            if frequencies and not os.path.isfile(file_name):
                 if not os.path.isfile(file_name):
-                    unique_terms = set(pdf_list)
-                    term_counts = {term:pdf_list.count(term) for term in unique_terms}
-                    df = pd.DataFrame(list(term_counts.items()), columns=['term', 'frequency'])
-                    df = df.sort_values(by='frequency', ascending=False)
+                    df = pd.DataFrame(list(frequencies.items()), columns=['term', 'frequency'])
+                    df = df.sort_values(by=['frequency', 'term'], ascending=[False, True])
                     if save_pdf: 
                         df.to_csv(file_name.replace('.png','.csv'), header=True, index=False)
                     df = df.head(top)
@@ -269,30 +492,63 @@ class PreProcessor():
         image_path:str=None, 
         stemming_alg:str='Porter', 
         ext_stopword_list:list=[], 
-        n_gram_value:int=1, 
+        n_gram_value=1, 
         wordclouds=False, 
         tf_plots=False, 
         tokenizer='nltk',
         upper_fth=6e23,
         lower_fth=0,
+        freq_filter='document',
+        token_cache=None,
         ) -> dict:
         '''
         Combining pre-processing into single method for convenience.
+        n_gram_value - single n-gram length (returns list of n-grams) or list of lengths 
+                       (text is cleaned once, returns dict mapping each length to list of n-grams).
+        token_cache - TokenCache to store cleaned tokens, pdf_dict=None loads cleaned tokens from it (text is extracted again if entry is missing).
+        '''
+        cached = token_cache.get(file_name) if token_cache is not None and pdf_dict is None else None
+        if cached is not None:
+            pdf_dict = cached
+        else:
+            if pdf_dict is None:
+                #cache entry was evicted or could not be decoded after the file was skipped - text is extracted again
+                logging.warning(f'Cached tokens are not available for {file_name} - extracting text from pdf file.')
+                pdf = TextParser.read_pdf(file_name, remove_corrupted=False)
+                pdf_dict = pdf['text'] if pdf is not None else {}
+            pdf_dict = PreProcessor.clean_document(pdf_dict, stemming_alg=stemming_alg, ext_stopword_list=ext_stopword_list, tokenizer=tokenizer)
+            if token_cache is not None:
+                token_cache.put(file_name, pdf_dict)
+        n_gram_values = n_gram_value if isinstance(n_gram_value, (list, tuple)) else [n_gram_value]
+        results = {}
+        for n in n_gram_values:
+            #generate_ngrams modifies pages in place - each n-gram length gets its own copy
+            pages = {k:list(v) for k, v in pdf_dict.items()} if len(n_gram_values) > 1 else pdf_dict
+            pdf_list = PreProcessor.generate_ngrams(pages, n=n, upper_th=upper_fth, lower_th=lower_fth, freq_filter=freq_filter)
+
+            fname = str(os.path.basename(file_name).replace('.pdf',''))
+            wordcloud_path = os.path.join(image_path, fname) + f'{n}.png'
+            wc_condition = (image_path is not None) and (not os.path.isfile(wordcloud_path)) and wordclouds
+            tf_condition = tf_plots
+            if wc_condition:
+                PreProcessor.plot_wordcloud(pdf_list=pdf_list, file_name=wordcloud_path)
+            elif tf_condition:
+                PreProcessor.plot_tfplot(pdf_list=pdf_list, file_name=wordcloud_path)
+            results[n] = pdf_list
+        if isinstance(n_gram_value, (list, tuple)):
+            return results
+        return results[n_gram_value]
+
+
+    @staticmethod
+    def clean_document(pdf_dict, stemming_alg:str='Porter', ext_stopword_list:list=[], tokenizer='nltk') -> dict:
+        '''
+        Given a document, represented as dictionary where page number is mapped to text,
+        returns dictionary mapping page number to cleaned (tokenized, stopword-free and stemmed) tokens.
         '''
         pdf_dict = PreProcessor.clear_text_case_punct(pdf_dict, tokenizer=tokenizer)
         pdf_dict = PreProcessor.remove_stopwords(pdf_dict, extended_list=ext_stopword_list)
-        pdf_dict = PreProcessor.stemming(pdf_dict, algorithm=stemming_alg)
-        pdf_list = PreProcessor.generate_ngrams(pdf_dict, n=n_gram_value, upper_th=upper_fth, lower_th=lower_fth)
-
-        fname = str(os.path.basename(file_name).replace('.pdf',''))
-        wordcloud_path = os.path.join(image_path, fname) + f'{n_gram_value}.png'
-        wc_condition = (image_path is not None) and (not os.path.isfile(wordcloud_path)) and wordclouds
-        tf_condition = tf_plots
-        if wc_condition:
-            PreProcessor.plot_wordcloud(pdf_list=pdf_list, file_name=wordcloud_path)
-        elif tf_condition:
-            PreProcessor.plot_tfplot(pdf_list=pdf_list, file_name=wordcloud_path)
-        return pdf_list
+        return PreProcessor.stemming(pdf_dict, algorithm=stemming_alg)
 
 
     @staticmethod
@@ -306,61 +562,1043 @@ class PreProcessor():
         tf_plots=False, 
         tokenizer='nltk',
         lower_fth=0,
-        upper_fth=6e23):
-        '''Preprocessing wrapper for pdf generator'''
+        upper_fth=6e23,
+        freq_filter='document',
+        workers:int=1,
+        token_cache=None):
+        '''
+        Preprocessing wrapper for pdf generator
+        workers - number of processes used for preprocessing, 1 - documents are preprocessed in current process
+        token_cache - TokenCache used to store and load cleaned tokens (files yielded with text=None are loaded from cache)
+        '''
         os.makedirs(output_path, exist_ok=True)
         logging.info('Starting preprocessing.')
         if stemming_alg in ['Porter', 'Snowball']:
             logging.info(f'Running stemming using {stemming_alg} algorithm.')
         else:
             logging.warning(f'Unrecognized value was given for stemming algorithm - {stemming_alg} - stemming will be skipped.')
-        for file in pdf_generator:
-            yield {'name':file['name'], 'result':PreProcessor.preprocess_document(
-                pdf_dict=file['text'], 
-                file_name=file['name'], 
-                image_path=output_path, 
-                stemming_alg=stemming_alg, 
-                ext_stopword_list=ext_stopword_list, 
-                n_gram_value=n_gram_value,
-                wordclouds=wordclouds,
-                tf_plots=tf_plots,
-                tokenizer=tokenizer,
-                lower_fth=lower_fth,
-                upper_fth=upper_fth
-                )}
-
-
-    @staticmethod
-    def aggragate_tfs(output_path:str, n_gram_value=1):
-        '''Aggregating term frequencies for all documents in corpus.'''
-        tag = os.path.join(output_path, 'wordclouds/') + f"*{n_gram_value}.csv"
-        total_df = pd.DataFrame()
-        for path in glob(tag):
-            total_df = pd.concat([total_df, pd.read_csv(path)])
-        total_df = total_df.groupby('term').agg('sum').reset_index().sort_values(by='frequency', ascending=False)
+        doc_kwargs = {
+            'image_path':output_path, 
+            'stemming_alg':stemming_alg, 
+            'ext_stopword_list':ext_stopword_list, 
+            'n_gram_value':n_gram_value,
+            'wordclouds':wordclouds,
+            'tf_plots':tf_plots,
+            'tokenizer':tokenizer,
+            'lower_fth':lower_fth,
+            'upper_fth':upper_fth,
+            'freq_filter':freq_filter,
+            'token_cache':token_cache
+            }
+        if workers is None or int(workers) <= 1:
+            for file in pdf_generator:
+                yield {'name':file['name'], 'result':PreProcessor.preprocess_document(
+                    pdf_dict=file['text'], 
+                    file_name=file['name'], 
+                    **doc_kwargs
+                    )}
+            logging.info(f'Token quality cache statistics: {TokenQuality.cache_info()}')
+            return
+
+        logging.info(f'Running preprocessing using {workers} processes.')
+        with ProcessPoolExecutor(
+            max_workers=int(workers), 
+            initializer=PreProcessor.init_worker, 
+            initargs=(stemming_alg, ext_stopword_list, tokenizer)
+            ) as executor:
+            #bounded number of documents in flight, results are yielded in input order
+            pending = deque()
+            for file in pdf_generator:
+                pending.append((file['name'], executor.submit(PreProcessor.preprocess_document, file['text'], file['name'], **doc_kwargs)))
+                if len(pending) >= int(workers) * 2:
+                    name, future = pending.popleft()
+                    yield {'name':name, 'result':future.result()}
+            while pending:
+                name, future = pending.popleft()
+                yield {'name':name, 'result':future.result()}
+
+
+    @staticmethod
+    def init_worker(stemming_alg:str='Porter', ext_stopword_list:list=[], tokenizer:str='nltk') -> None:
+        '''Process pool initializer - builds tokenizer, stemmer and stopword set once per worker process.'''
+        PreProcessor.get_stemmer(stemming_alg)
+        PreProcessor.get_stop_words(tuple(ext_stopword_list))
+        TokenizerBackend.warm_up(tokenizer)
+
+
+    @staticmethod
+    def aggragate_tfs(output_path:str, n_gram_value=1, store_path:str=None):
+        '''
+        Aggregating term frequencies for all documents in corpus.
+        store_path - TermFrequencyStore with per-document frequencies, output_path/tf_store/<n_gram_value> by default.
+        '''
+        import pandas as pd
+        if store_path is None:
+            store_path = os.path.join(output_path, 'tf_store', str(n_gram_value))
+        terms, frequency = TermFrequencyStore.totals(store_path)
+        order = np.lexsort((terms, -frequency))
+        total_df = pd.DataFrame({'term':terms[order], 'frequency':frequency[order]})
         if n_gram_value == 1:
-            def max_char_freq(string):
-                alphabet = set(string)
-                max_freq = 0
-                for c in alphabet:
-                    freq = string.count(c)
-                    if freq > max_freq:
-                        max_freq = freq
-                return  max_freq
-            
-            def max_dimer_freq(string):
-                '''Dimer frequency scan to detect words made from single character and words of 2 characters'''
-                max_freq = 0
-                for i in range(len(string)-1):
-                    dimer = string[i:i+2]
-                    #counting overlapping dimers
-                    count = len(re.findall(f'(?={dimer})', string))
-
-                    if count > max_freq:
-                        max_freq = count
-                return round(max_freq/len(string),1)
-
-            total_df['token_len'] = total_df['term'].apply(len)
-            total_df['max_char_count'] = total_df['term'].apply(max_char_freq)
-            total_df['max_dimer_freq'] = total_df['term'].apply(max_dimer_freq)
-        total_df.to_csv(os.path.join(output_path,f'corpus_tf_{n_gram_value}.csv'), header=True, index=False)
\ No newline at end of file
+            for column, values in TokenQuality.shape_features(total_df['term'].to_numpy()).items():
+                total_df[column] = values
+        total_df.to_csv(os.path.join(output_path,f'corpus_tf_{n_gram_value}.csv'), header=True, index=False)
+
+
+#############
+#Token corpus
+#############
+
+class TokenCorpus():
+    '''
+    Compact corpus container - tokens are interned to int32 ids once and all documents are kept in one contiguous id array,
+    document i spans ids[offsets[i]:offsets[i+1]], names holds document names.
+    Iterating yields documents as token lists, so the corpus can be used wherever a list of documents is expected.
+    Saved corpus can be loaded with memory-mapped id and offset arrays.
+    '''
+    def __init__(self, tokens:list=None, ids:np.ndarray=None, offsets:np.ndarray=None, names:list=None):
+        self.tokens = list(tokens) if tokens is not None else []
+        self.token2id = {token:token_id for token_id, token in enumerate(self.tokens)}
+        self.names = list(names) if names is not None else []
+        self._ids = ids if ids is not None else np.zeros(0, dtype=np.int32)
+        self._offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self._chunks, self._lengths = [], []
+        self._token_array = None
+
+
+    def add(self, name:str, doc:list) -> None:
+        '''Appends document (list of tokens), new tokens are interned.'''
+        token2id = self.token2id
+        for token in doc:
+            if token not in token2id:
+                token2id[token] = len(self.tokens)
+                self.tokens.append(token)
+        self._chunks.append(np.fromiter((token2id[token] for token in doc), dtype=np.int32, count=len(doc)))
+        self._lengths.append(len(doc))
+        self.names.append(name)
+        self._token_array = None
+
+
+    def _consolidate(self) -> None:
+        '''Merges documents added since last call into contiguous arrays.'''
+        if self._chunks:
+            self._ids = np.concatenate([self._ids] + self._chunks)
+            self._offsets = np.concatenate([self._offsets, self._offsets[-1] + np.cumsum(self._lengths, dtype=np.int64)])
+            self._chunks, self._lengths = [], []
+
+
+    @property
+    def ids(self) -> np.ndarray:
+        self._consolidate()
+        return self._ids
+
+
+    @property
+    def offsets(self) -> np.ndarray:
+        self._consolidate()
+        return self._offsets
+
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+    def doc_ids(self, i:int) -> np.ndarray:
+        '''Token ids of document i.'''
+        offsets = self.offsets
+        return self.ids[offsets[i]:offsets[i+1]]
+
+
+    def __iter__(self):
+        if self._token_array is None:
+            self._token_array = np.array(self.tokens, dtype=object)
+        for i in range(len(self)):
+            yield self._token_array[self.doc_ids(i)].tolist()
+
+
+    def vocab_ids(self, vocab) -> np.ndarray:
+        '''Maps corpus token ids to ids of gensim dictionary, -1 for tokens missing from the dictionary.'''
+        return np.fromiter((vocab.token2id.get(token, -1) for token in self.tokens), dtype=np.int64, count=len(self.tokens))
+
+
+    def iter_vocab_ids(self, vocab):
+        '''Generator of documents as arrays of gensim dictionary ids (tokens missing from dictionary are dropped).'''
+        mapping = self.vocab_ids(vocab)
+        for i in range(len(self)):
+            token_ids = mapping[self.doc_ids(i)]
+            yield token_ids[token_ids >= 0]
+
+
+    def filter_by_frequency(self, upper_th=950, lower_th=3):
+        '''Collection-wide frequency filter (see PreProcessor.filter_corpus_by_frequency), returns new TokenCorpus.'''
+        ids, offsets = self.ids, self.offsets
+        counts = np.bincount(ids, minlength=len(self.tokens))
+        keep = ((counts > lower_th) & (counts < upper_th))[ids]
+        #number of kept tokens before each position gives new document boundaries
+        kept_before = np.concatenate([[0], np.cumsum(keep, dtype=np.int64)])
+        return TokenCorpus(tokens=self.tokens, ids=ids[keep], offsets=kept_before[offsets], names=self.names)
+
+
+    def save(self, path:str) -> None:
+        '''Saves corpus to folder - ids.npy, offsets.npy, tokens.json and names.json.'''
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'ids.npy'), self.ids)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        with open(os.path.join(path, 'tokens.json'), 'w') as f:
+            json.dump(self.tokens, f)
+        with open(os.path.join(path, 'names.json'), 'w') as f:
+            json.dump(self.names, f)
+
+
+    @staticmethod
+    def load(path:str, mmap:bool=True):
+        '''Loads corpus saved with save, mmap - memory-map id and offset arrays instead of reading them into memory.'''
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, 'tokens.json'), 'r') as f:
+            tokens = json.load(f)
+        with open(os.path.join(path, 'names.json'), 'r') as f:
+            names = json.load(f)
+        return TokenCorpus(
+            tokens=tokens,
+            ids=np.load(os.path.join(path, 'ids.npy'), mmap_mode=mmap_mode),
+            offsets=np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode),
+            names=names
+            )
+
+
+#####################
+#Vowpal Wabbit files
+#####################
+
+class VWWriter():
+    '''
+    Vowpal Wabbit corpus writer.
+    compact - write each document as "doc_id token:count ..." (count omitted when 1), otherwise every token occurrence is repeated
+    compression - None, 'gzip' or 'zstd' (requires zstandard package)
+    Lines are formatted with str.join and written in bulk every flush_lines documents through a large file buffer.
+    '''
+    SUFFIXES = {None:'', 'gzip':'.gz', 'zstd':'.zst'}
+
+    def __init__(self, path:str, compact:bool=True, compression:str=None, buffer_size:int=2**22, flush_lines:int=1024):
+        self.path = path
+        self.compact = compact
+        self.flush_lines = flush_lines
+        self._file = VWWriter.open_file(path, 'w', compression=compression, buffer_size=buffer_size)
+        self._lines = []
+
+
+    @staticmethod
+    def file_path(output_path:str, file_name:str, compression:str=None) -> str:
+        '''Path of VW file of the model, with suffix of the compression format.'''
+        return os.path.join(output_path, f'{file_name}_vw.txt') + VWWriter.SUFFIXES[compression]
+
+
+    @staticmethod
+    def compression_of(path:str) -> str:
+        '''Compression format detected from file suffix.'''
+        for compression, suffix in VWWriter.SUFFIXES.items():
+            if suffix and path.endswith(suffix):
+                return compression
+        return None
+
+
+    @staticmethod
+    def open_file(path:str, mode:str='r', compression:str=None, buffer_size:int=2**22):
+        '''Opens (optionally compressed) VW file in text mode, mode - 'r' or 'w'.'''
+        if compression == 'gzip':
+            return gzip.open(path, mode + 't', encoding='utf-8')
+        if compression == 'zstd':
+            import zstandard
+            return zstandard.open(path, mode + 't', encoding='utf-8')
+        return open(path, mode, buffering=buffer_size, encoding='utf-8')
+
+
+    @staticmethod
+    def format_line(doc_name:str, doc, compact:bool=True) -> str:
+        '''VW line of document (list of tokens or dict mapping token to count), empty string for empty document.'''
+        if not doc:
+            return ''
+        if compact:
+            counts = doc if isinstance(doc, dict) else Counter(doc)
+            words = [token if count == 1 else f'{token}:{count}' for token, count in counts.items()]
+        else:
+            words = list(itertools.chain.from_iterable(itertools.repeat(token, count) for token, count in doc.items())) if isinstance(doc, dict) else doc
+        return PreProcessor.vw_doc_id(doc_name) + ' ' + ' '.join(words) + '\n'
+
+
+    def write(self, doc_name:str, doc) -> None:
+        '''Adds document to the file.'''
+        line = VWWriter.format_line(doc_name, doc, compact=self.compact)
+        if line:
+            self.write_line(line)
+
+
+    def write_line(self, line:str) -> None:
+        '''Adds preformatted line (ending with new line) to the file.'''
+        self._lines.append(line)
+        if len(self._lines) >= self.flush_lines:
+            self.flush()
+
+
+    def flush(self) -> None:
+        self._file.write(''.join(self._lines))
+        self._lines = []
+
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class VWReader():
+    '''Streaming reader of plain and compact (optionally gzip/zstd compressed) Vowpal Wabbit files.'''
+
+    @staticmethod
+    def lines(path:str):
+        '''Generator of raw lines, compression is detected from file suffix.'''
+        with VWWriter.open_file(path, 'r', compression=VWWriter.compression_of(path)) as f:
+            yield from f
+
+
+    @staticmethod
+    def parse_line(line:str) -> tuple:
+        '''Returns (doc_id, dict mapping token to count) for single VW line.'''
+        parts = line.split()
+        counts = Counter()
+        for word in parts[1:]:
+            token, sep, count = word.rpartition(':')
+            if sep and count.isdigit():
+                counts[token] += int(count)
+            else:
+                counts[word] += 1
+        return parts[0], counts
+
+
+    @staticmethod
+    def documents(path:str):
+        '''Generator of (doc_id, dict mapping token to count) for all documents in VW file.'''
+        for line in VWReader.lines(path):
+            if line.strip():
+                yield VWReader.parse_line(line)
+
+
+################
+#BigARTM batches
+################
+
+class ARTMBatchWriter():
+    '''
+    Writes BigARTM batches (serialized artm.messages.Batch, batch_size documents per .batch file) and dictionary,
+    so that ARTM models can be trained with artm.BatchVectorizer(data_format='batches') without parsing VW file.
+    Batch contents are prepared from TokenCorpus (or streamed from VW file) and serialized by worker processes.
+    '''
+
+    @staticmethod
+    def corpus_shards(corpus:TokenCorpus, batch_size:int=1000):
+        '''Generator of batch contents (titles, tokens, item offsets, token ids, token weights) of TokenCorpus documents.'''
+        ids, offsets = corpus.ids, corpus.offsets
+        num_tokens = max(len(corpus.tokens), 1)
+        for start in range(0, len(corpus), batch_size):
+            stop = min(start + batch_size, len(corpus))
+            shard_offsets = offsets[start:stop+1]
+            shard_ids = np.asarray(ids[shard_offsets[0]:shard_offsets[-1]], dtype=np.int64)
+            doc_index = np.repeat(np.arange(stop - start, dtype=np.int64), np.diff(shard_offsets))
+            #unique (document, token) pairs are sorted by document, so tokens of each item are contiguous
+            keys, weights = np.unique(doc_index * num_tokens + shard_ids, return_counts=True)
+            item_index, token_index = np.divmod(keys, num_tokens)
+            local_tokens, token_ids = np.unique(token_index, return_inverse=True)
+            item_offsets = np.searchsorted(item_index, np.arange(stop - start + 1))
+            titles = [PreProcessor.vw_doc_id(name) for name in corpus.names[start:stop]]
+            yield titles, [corpus.tokens[token] for token in local_tokens.tolist()], item_offsets, token_ids, weights
+
+
+    @staticmethod
+    def vw_shards(vw_path:str, batch_size:int=1000):
+        '''Generator of batch contents (see corpus_shards) of documents streamed from VW file.'''
+        documents = VWReader.documents(vw_path)
+        while True:
+            shard = list(itertools.islice(documents, batch_size))
+            if not shard:
+                return
+            token2id, token_ids, weights, item_offsets = {}, [], [], [0]
+            for _, counts in shard:
+                for token, count in counts.items():
+                    token_ids.append(token2id.setdefault(token, len(token2id)))
+                    weights.append(count)
+                item_offsets.append(len(token_ids))
+            yield [doc_id for doc_id, _ in shard], list(token2id), np.array(item_offsets), np.array(token_ids), np.array(weights)
+
+
+    @staticmethod
+    def write_batch(batch_path:str, titles:list, tokens:list, item_offsets, token_ids, token_weights, first_item_id:int=0) -> int:
+        '''
+        Serializes single batch, item i holds token_ids/token_weights[item_offsets[i]:item_offsets[i+1]] (local ids in tokens).
+        Empty documents are skipped as in VW files, returns number of written items.
+        '''
+        import artm
+        batch = artm.messages.Batch()
+        batch.id = str(uuid.uuid4())
+        batch.token.extend(tokens)
+        batch.class_id.extend(['@default_class'] * len(tokens))
+        for i, title in enumerate(titles):
+            start, stop = item_offsets[i], item_offsets[i+1]
+            if start == stop:
+                continue
+            item = batch.item.add()
+            item.id = first_item_id + i
+            item.title = title
+            item.token_id.extend(token_ids[start:stop].tolist())
+            item.token_weight.extend(token_weights[start:stop].astype(float).tolist())
+        with open(batch_path, 'wb') as f:
+            f.write(batch.SerializeToString())
+        return len(batch.item)
+
+
+    @staticmethod
+    def write_batches(shards, batch_folder:str, workers:int=1) -> int:
+        '''
+        Writes batch files for shards generated by corpus_shards or vw_shards, returns number of written documents.
+        workers - processes serializing batches, 0 - write in main process.
+        '''
+        os.makedirs(batch_folder, exist_ok=True)
+        #batches left from previous runs would be loaded by BatchVectorizer together with new ones
+        for path in glob(os.path.join(batch_folder, '*.batch')):
+            os.remove(path)
+        num_docs, num_batches, first_item_id = 0, 0, 0
+        if workers <= 0:
+            for num_batches, shard in enumerate(shards, start=1):
+                num_docs += ARTMBatchWriter.write_batch(os.path.join(batch_folder, f'{num_batches:06d}.batch'), *shard, first_item_id)
+                first_item_id += len(shard[0])
+        else:
+            pending = deque()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for num_batches, shard in enumerate(shards, start=1):
+                    pending.append(executor.submit(ARTMBatchWriter.write_batch, os.path.join(batch_folder, f'{num_batches:06d}.batch'), *shard, first_item_id))
+                    first_item_id += len(shard[0])
+                    #shards are prepared while earlier batches are serialized, at most two batches per worker are queued
+                    while pending and (pending[0].done() or len(pending) > 2 * workers):
+                        num_docs += pending.popleft().result()
+                while pending:
+                    num_docs += pending.popleft().result()
+        logging.info(f'Saved {num_docs} documents to {num_batches} BigARTM batches in {batch_folder}')
+        return num_docs
+
+
+    @staticmethod
+    def write_dictionary(batch_folder:str, dictionary_path:str, vocab_path:str=None, cooc_path:str=None) -> None:
+        '''
+        Gathers BigARTM dictionary from batches (with co-occurrence values from cooc file) and saves it,
+        experiments can load it with artm.Dictionary().load(dictionary_path) instead of gathering it again.
+        '''
+        import artm
+        dictionary = artm.Dictionary()
+        dictionary.gather(data_path=batch_folder, vocab_file_path=vocab_path, cooc_file_path=cooc_path, symmetric_cooc_values=True)
+        if os.path.isfile(dictionary_path):
+            os.remove(dictionary_path)
+        dictionary.save(dictionary_path=dictionary_path)
+        logging.info(f'Saved BigARTM dictionary to {dictionary_path}')
+
+
+##############
+#Token caching
+##############
+
+class TokenCache():
+    '''
+    On-disk content-addressed cache of cleaned token streams.
+    Entries are keyed by the hash of pdf file contents combined with the tokenizer, stopword and stemming configuration,
+    and stored as zlib-compressed token streams (pages separated by new lines, tokens by spaces).
+    '''
+    FORMAT_VERSION = 1
+    MAGIC = b'MSCT'
+
+    def __init__(self, cache_path:str, tokenizer:str='nltk', ext_stopword_list:list=[], stemming_alg:str='Porter', max_size_mb:float=1024, max_age_days:float=30):
+        self.cache_path = cache_path
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+        config = {
+            'version':TokenCache.FORMAT_VERSION,
+            'tokenizer':tokenizer,
+            'stopwords':sorted(PreProcessor.get_stop_words(tuple(ext_stopword_list))),
+            'stemming':stemming_alg,
+            }
+        self.fingerprint = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+        self._keys = {}
+        os.makedirs(cache_path, exist_ok=True)
+
+
+    def __getstate__(self) -> dict:
+        '''Cache is passed to preprocessing workers with every document - memo of file keys is left out.'''
+        state = dict(self.__dict__)
+        state['_keys'] = {}
+        return state
+
+
+    def key(self, path:str) -> str:
+        '''Cache key for pdf file - hash of file contents and preprocessing configuration.'''
+        stat = os.stat(path)
+        memo_key = (path, stat.st_mtime_ns, stat.st_size)
+        if memo_key not in self._keys:
+            self._keys[memo_key] = file_hash(path, digest=hashlib.sha256(self.fingerprint.encode('utf-8')))
+        return self._keys[memo_key]
+
+
+    def entry_path(self, key:str) -> str:
+        return os.path.join(self.cache_path, key[:2], f'{key}.tok')
+
+
+    def contains(self, path:str) -> bool:
+        try:
+            return os.path.isfile(self.entry_path(self.key(path)))
+        except OSError:
+            return False
+
+
+    @staticmethod
+    def dump_tokens(entry:str, pdf_dict:dict) -> None:
+        '''Writes token stream file atomically, pdf_dict maps page number to tokens.'''
+        text = '\n'.join(' '.join(pdf_dict[k]) for k in pdf_dict)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_path = f'{entry}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(TokenCache.MAGIC + zlib.compress(text.encode('utf-8'), 6))
+        os.replace(tmp_path, entry)
+
+
+    @staticmethod
+    def load_tokens(entry:str) -> dict:
+        '''Reads token stream file written by dump_tokens.'''
+        with open(entry, 'rb') as f:
+            data = f.read()
+        if data[:len(TokenCache.MAGIC)] != TokenCache.MAGIC:
+            raise ValueError('unrecognized token stream format')
+        text = zlib.decompress(data[len(TokenCache.MAGIC):]).decode('utf-8')
+        return {i:page.split(' ') if page else [] for i, page in enumerate(text.split('\n'))}
+
+
+    def get(self, path:str) -> dict:
+        '''Returns cleaned tokens for pdf file as dictionary mapping page number to tokens, None if not cached.'''
+        entry = self.entry_path(self.key(path))
+        try:
+            pdf_dict = TokenCache.load_tokens(entry)
+            #refreshing entry age
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error(f'Failed to read token cache entry {entry} - {e}')
+            return None
+        return pdf_dict
+
+
+    def put(self, path:str, pdf_dict:dict) -> None:
+        '''Stores cleaned tokens for pdf file, pdf_dict maps page number to tokens.'''
+        entry = self.entry_path(self.key(path))
+        try:
+            TokenCache.dump_tokens(entry, pdf_dict)
+        except OSError as e:
+            logging.error(f'Failed to write token cache entry {entry} - {e}')
+
+
+    def evict(self) -> None:
+        '''Removes entries older than max_age_days, then least recently used entries until cache fits into max_size_mb.'''
+        entries = []
+        for entry in glob(os.path.join(self.cache_path, '*', '*.tok')):
+            try:
+                stat = os.stat(entry)
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            except OSError:
+                continue
+        entries.sort()
+        min_mtime = time.time() - self.max_age_days * 86400 if self.max_age_days is not None else None
+        total_size = sum(size for _, size, _ in entries)
+        max_size = self.max_size_mb * 1024 * 1024 if self.max_size_mb is not None else None
+        removed = 0
+        for mtime, size, entry in entries:
+            too_old = min_mtime is not None and mtime < min_mtime
+            too_big = max_size is not None and total_size > max_size
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(entry)
+                total_size -= size
+                removed += 1
+            except OSError as e:
+                logging.error(f'Failed to remove token cache entry {entry} - {e}')
+        logging.info(f'Token cache: removed {removed} entries, {round(total_size / 1024 / 1024, 2)} MB in use.')
+
+
+#############
+#Co-occurence
+#############
+
+class CoocMatrix():
+    '''
+    Symmetric co-occurrence counts accumulated from token-id arrays into sparse matrix.
+    Only upper triangle is stored - pair (id_1, id_2) is kept with id_1 < id_2.
+    Each pair of positions within the window counts twice, matching count_cooc_python 
+    (co-occurrence is counted from the point of view of both tokens).
+    '''
+    def __init__(self, window:int=10, num_terms:int=0, flush_size:int=10_000_000):
+        self.window = window
+        self.num_terms = num_terms
+        self.flush_size = flush_size
+        from scipy.sparse import csr_matrix
+        self.matrix = csr_matrix((num_terms, num_terms), dtype=np.int64)
+        self._rows, self._cols, self._data = [], [], []
+        self._buffered = 0
+
+
+    def add(self, token_ids, weight:int=1) -> None:
+        '''Adds co-occurrences from a single document given as array of token ids, weight=-1 retracts the document.'''
+        token_ids = np.asarray(token_ids, dtype=np.int64)
+        if token_ids.size < 2:
+            return
+        self.num_terms = max(self.num_terms, int(token_ids.max()) + 1)
+        for offset in range(1, min(self.window, token_ids.size - 1) + 1):
+            left, right = token_ids[:-offset], token_ids[offset:]
+            mask = left != right
+            left, right = left[mask], right[mask]
+            self._rows.append(np.minimum(left, right))
+            self._cols.append(np.maximum(left, right))
+            self._data.append(np.full(left.size, 2 * weight, dtype=np.int64))
+            self._buffered += left.size
+        if self._buffered >= self.flush_size:
+            self.flush()
+
+
+    def flush(self) -> None:
+        '''Merges buffered pairs into the sparse matrix.'''
+        if self.matrix.shape[0] < self.num_terms:
+            self.matrix.resize((self.num_terms, self.num_terms))
+        if self._buffered:
+            from scipy.sparse import coo_matrix
+            batch = coo_matrix(
+                (np.concatenate(self._data), (np.concatenate(self._rows), np.concatenate(self._cols))), 
+                shape=(self.num_terms, self.num_terms)
+                )
+            self.matrix = self.matrix + batch.tocsr()
+            self.matrix.eliminate_zeros()
+        self._rows, self._cols, self._data = [], [], []
+        self._buffered = 0
+
+
+    def to_coo(self):
+        '''Returns accumulated counts as coo_matrix sorted by (id_1, id_2).'''
+        self.flush()
+        self.matrix.sort_indices()
+        return self.matrix.tocoo()
+
+
+    def write(self, cooc_path:str, chunk_size:int=100_000) -> None:
+        '''Writes counts in bulk as "id_1 id_2 count" lines.'''
+        coo = self.to_coo()
+        triples = np.column_stack((coo.row, coo.col, coo.data))
+        with open(cooc_path, 'w') as f:
+            for start in range(0, len(triples), chunk_size):
+                chunk = triples[start:start + chunk_size]
+                f.write(('%d %d %d\n' * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+class StreamingCorpusWriter():
+    '''
+    Builds vocabulary, co-occurrence counts, Vowpal Wabbit file and Matrix Market bag-of-words corpus 
+    incrementally from a stream of documents, so that documents do not have to be kept in memory.
+    Word ids are assigned in the same order as in PreProcessor.gen_vocab, so the output matches the in-memory pipeline.
+    '''
+    def __init__(self, output_path:str, file_name:str, window:int=10, compact:bool=vw_compact, compression:str=vw_compression):
+        import gensim.corpora as corpora
+        from gensim.matutils import MmWriter
+        self.vocab = corpora.Dictionary()
+        self.cooc = CoocMatrix(window=window)
+        self.vw_path = VWWriter.file_path(output_path, file_name, compression)
+        self.mm_path = os.path.join(output_path, f'{file_name}_corpus.mm')
+        self._vw_file = VWWriter(self.vw_path, compact=compact, compression=compression)
+        self._mm_writer = MmWriter(self.mm_path)
+        self._mm_writer.write_headers(-1, -1, -1)
+        self.num_docs, self.num_nnz = 0, 0
+
+
+    def add(self, name:str, doc:list) -> None:
+        '''Adds single document (list of tokens) to all outputs.'''
+        bow = self.vocab.doc2bow(doc, allow_update=True)
+        self.cooc.add(np.fromiter((self.vocab.token2id[token] for token in doc), dtype=np.int64))
+        self._vw_file.write(name, doc)
+        _, veclen = self._mm_writer.write_vector(self.num_docs, bow)
+        self.num_docs += 1
+        self.num_nnz += veclen
+
+
+    def close(self, vocab_path:str, cooc_path:str):
+        '''Finalizes all outputs, writes vocabulary and co-occurrence files and returns the vocabulary.'''
+        self._vw_file.close()
+        self._mm_writer.fake_headers(self.num_docs, len(self.vocab), self.num_nnz)
+        self._mm_writer.close()
+        logging.info(f'Saved {self.num_docs} documents to {self.mm_path}')
+        PreProcessor.save_vocab(self.vocab, vocab_path)
+        self.cooc.write(cooc_path)
+        return self.vocab
+
+
+############################
+#Incremental corpus updates
+############################
+
+class CorpusManifest():
+    '''
+    Manifest of pdf files already processed into the output folder (file name mapped to content hash).
+    Used to detect new, changed and removed documents for incremental updates.
+    If preprocessing settings differ from the ones recorded in manifest, all documents are treated as new (reset=True).
+    state_paths - IncrementalCorpus state folders, all documents are treated as new if state of any of them is missing.
+    '''
+    def __init__(self, output_path:str, settings:dict, state_paths:list=[]):
+        self.path = os.path.join(output_path, 'manifest.json')
+        self.settings = settings
+        self.documents = {}
+        self.reset = True
+        self._hashes = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('settings') != settings:
+                logging.warning(f'Preprocessing settings differ from {self.path} - rebuilding corpus from scratch.')
+            elif not all(IncrementalCorpus.exists(state_path) for state_path in state_paths):
+                logging.warning(f'Incremental corpus state recorded in {self.path} is missing - rebuilding corpus from scratch.')
+            else:
+                self.documents = manifest.get('documents', {})
+                self.reset = False
+
+
+    def diff(self, paths:list):
+        '''
+        Compares pdf files with manifest, returns list of paths to process (new or changed files) 
+        and list of document names which contributions should be retracted (changed or removed files).
+        '''
+        to_process, retracted, present = [], [], set()
+        for path in paths:
+            name = os.path.basename(path)
+            present.add(name)
+            self._hashes[name] = file_hash(path)
+            if self.documents.get(name) != self._hashes[name]:
+                to_process.append(path)
+                if name in self.documents:
+                    retracted.append(name)
+        retracted += [name for name in self.documents if name not in present]
+        logging.info(f'Incremental update: {len(to_process)} new or changed documents, {len(retracted)} documents to retract.')
+        return to_process, retracted
+
+
+    def update(self, added:list, retracted:list) -> None:
+        '''Records processed and retracted documents and saves the manifest.'''
+        for name in retracted:
+            self.documents.pop(name, None)
+        for name in added:
+            self.documents[name] = self._hashes[name]
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'settings':self.settings, 'documents':self.documents}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+class IncrementalCorpus():
+    '''
+    Vocabulary, co-occurrence counts and VW file for documents of single n-gram length, 
+    persisted in state_path so that documents can be added and retracted without reprocessing the collection.
+    N-gram stream of every document is kept in state_path to be able to retract its contributions.
+    '''
+    def __init__(self, state_path:str, window:int=10, reset:bool=False):
+        self.state_path = state_path
+        self.window = window
+        self.index_path = os.path.join(state_path, 'index.json')
+        self.vocab_path = os.path.join(state_path, 'vocab.dict')
+        self.cooc_path = os.path.join(state_path, 'cooc.npz')
+        self.reset = reset
+        if reset and os.path.isdir(state_path):
+            shutil.rmtree(state_path)
+        os.makedirs(os.path.join(state_path, 'docs'), exist_ok=True)
+        self.cooc = CoocMatrix(window=window)
+        import gensim.corpora as corpora
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+            self.vocab = corpora.Dictionary.load(self.vocab_path)
+            from scipy.sparse import load_npz
+            self.cooc.matrix = load_npz(self.cooc_path).tocsr()
+            self.cooc.num_terms = self.cooc.matrix.shape[0]
+        else:
+            self.index = {}
+            self.vocab = corpora.Dictionary()
+        self._added, self._retracted = [], set()
+
+
+    @staticmethod
+    def exists(state_path:str) -> bool:
+        '''True if corpus state was saved in state_path.'''
+        return os.path.isfile(os.path.join(state_path, 'index.json'))
+
+
+    def _doc_path(self, name:str) -> str:
+        return os.path.join(self.state_path, 'docs', f"{hashlib.sha256(name.encode('utf-8')).hexdigest()}.tok")
+
+
+    def add(self, name:str, doc:list) -> None:
+        '''Adds contributions of document to vocabulary and co-occurrence counts.'''
+        if name in self.index:
+            self.retract(name)
+        self.vocab.doc2bow(doc, allow_update=True)
+        self.cooc.add(np.fromiter((self.vocab.token2id[token] for token in doc), dtype=np.int64))
+        TokenCache.dump_tokens(self._doc_path(name), {0:doc})
+        self.index[name] = os.path.basename(self._doc_path(name))
+        self._added.append(name)
+
+
+    def retract(self, name:str) -> None:
+        '''Removes contributions of previously added document.'''
+        if name not in self.index:
+            return
+        doc = TokenCache.load_tokens(self._doc_path(name))[0]
+        token_ids = np.fromiter((self.vocab.token2id[token] for token in doc), dtype=np.int64)
+        self.cooc.add(token_ids, weight=-1)
+        for token_id, count in Counter(token_ids.tolist()).items():
+            self.vocab.dfs[token_id] -= 1
+            self.vocab.cfs[token_id] -= count
+        self.vocab.num_docs -= 1
+        self.vocab.num_pos -= len(doc)
+        self.vocab.num_nnz -= len(set(doc))
+        os.remove(self._doc_path(name))
+        del self.index[name]
+        self._retracted.add(name)
+
+
+    def documents(self):
+        '''Generator of (name, n-gram list) for all documents in the corpus.'''
+        for name in self.index:
+            yield name, TokenCache.load_tokens(self._doc_path(name))[0]
+
+
+    def _drop_unused_terms(self) -> None:
+        '''Removes words not present in any document and remaps co-occurrence matrix to compacted word ids.'''
+        unused = [token_id for token_id, df in self.vocab.dfs.items() if df <= 0]
+        if not unused:
+            return
+        old_token2id = dict(self.vocab.token2id)
+        self.vocab.filter_tokens(bad_ids=unused)
+        id_map = np.full(max(len(old_token2id), self.cooc.num_terms), -1, dtype=np.int64)
+        for token, new_id in self.vocab.token2id.items():
+            id_map[old_token2id[token]] = new_id
+        coo = self.cooc.to_coo()
+        rows, cols = id_map[coo.row], id_map[coo.col]
+        keep = (rows >= 0) & (cols >= 0)
+        self.cooc = CoocMatrix(window=self.window, num_terms=len(self.vocab))
+        from scipy.sparse import coo_matrix
+        self.cooc.matrix = coo_matrix((coo.data[keep], (rows[keep], cols[keep])), shape=(len(self.vocab), len(self.vocab))).tocsr()
+
+
+    def close(self, vocab_path:str, cooc_path:str, vw_path:str, mm_path:str, compact:bool=vw_compact):
+        '''
+        Saves updated state, rewrites vocabulary, co-occurrence, VW and Matrix Market files, returns vocabulary.
+        VW file is compressed if vw_path ends with compression suffix (see VWWriter).
+        '''
+        self._drop_unused_terms()
+        self.cooc.flush()
+        self.vocab.save(self.vocab_path)
+        from scipy.sparse import save_npz
+        save_npz(self.cooc_path, self.cooc.matrix)
+        with open(self.index_path, 'w') as f:
+            json.dump(self.index, f, indent=4)
+        PreProcessor.save_vocab(self.vocab, vocab_path)
+        self.cooc.write(cooc_path)
+
+        #VW file - lines of unchanged documents are kept, lines of retracted documents are removed and new documents appended
+        stale = {PreProcessor.vw_doc_id(name) for name in self._retracted.union(self._added)}
+        kept = []
+        if os.path.isfile(vw_path) and not self.reset:
+            kept = [line for line in VWReader.lines(vw_path) if line.split(' ', 1)[0].rstrip('\n') not in stale]
+        with VWWriter(vw_path, compact=compact, compression=VWWriter.compression_of(vw_path)) as vw_file:
+            for line in kept:
+                vw_file.write_line(line)
+            for name in self._added:
+                if name in self.index:
+                    vw_file.write(name, TokenCache.load_tokens(self._doc_path(name))[0])
+
+        from gensim.corpora import MmCorpus
+        MmCorpus.serialize(mm_path, (self.vocab.doc2bow(doc) for _, doc in self.documents()), id2word=self.vocab)
+        logging.info(f'Incremental update: {len(self._added)} documents added, {len(self._retracted)} retracted, {len(self.index)} documents in corpus.')
+        self._added, self._retracted = [], set()
+        self.reset = False
+        return self.vocab
+
+
+
+#######################
+#Term frequency store
+#######################
+
+class TermFrequencyStore():
+    '''
+    Columnar store of per-document term frequencies.
+    Rows (document id, term id, count) are saved as NPZ partitions of partition_size documents,
+    terms and document names are saved once in terms.json and docs.json.
+    '''
+    def __init__(self, store_path:str, partition_size:int=1000):
+        self.store_path = store_path
+        self.partition_size = partition_size
+        if os.path.isdir(store_path):
+            shutil.rmtree(store_path)
+        os.makedirs(store_path)
+        self.term2id, self.docs = {}, []
+        self._doc_ids, self._term_ids, self._counts = [], [], []
+        self._num_parts = 0
+
+
+    def add(self, name:str, doc:list) -> None:
+        '''Adds term frequencies of single document (list of terms).'''
+        counts = Counter(doc)
+        doc_id = len(self.docs)
+        self.docs.append(name)
+        self._term_ids.append(np.fromiter((self.term2id.setdefault(term, len(self.term2id)) for term in counts), dtype=np.int32, count=len(counts)))
+        self._counts.append(np.fromiter(counts.values(), dtype=np.int32, count=len(counts)))
+        self._doc_ids.append(np.full(len(counts), doc_id, dtype=np.int32))
+        if len(self._doc_ids) >= self.partition_size:
+            self.flush()
+
+
+    def flush(self) -> None:
+        '''Writes buffered documents to next partition.'''
+        if not self._doc_ids:
+            return
+        np.savez(
+            os.path.join(self.store_path, f'part_{self._num_parts:05d}.npz'),
+            doc_id=np.concatenate(self._doc_ids),
+            term_id=np.concatenate(self._term_ids),
+            count=np.concatenate(self._counts)
+            )
+        self._num_parts += 1
+        self._doc_ids, self._term_ids, self._counts = [], [], []
+
+
+    def close(self) -> None:
+        '''Writes remaining documents, term and document lists.'''
+        self.flush()
+        with open(os.path.join(self.store_path, 'terms.json'), 'w') as f:
+            json.dump(list(self.term2id), f)
+        with open(os.path.join(self.store_path, 'docs.json'), 'w') as f:
+            json.dump(self.docs, f)
+
+
+    @staticmethod
+    def load(store_path:str) -> dict:
+        '''Returns all rows of the store as arrays (doc_id, term_id, count) together with terms and docs lists.'''
+        parts = [np.load(path) for path in sorted(glob(os.path.join(store_path, 'part_*.npz')))]
+        store = {column:np.concatenate([part[column] for part in parts]) if parts else np.zeros(0, dtype=np.int32) for column in ('doc_id', 'term_id', 'count')}
+        for key in ('terms', 'docs'):
+            with open(os.path.join(store_path, f'{key}.json'), 'r') as f:
+                store[key] = json.load(f)
+        return store
+
+
+    @staticmethod
+    def totals(store_path:str):
+        '''Corpus-wide frequency of each term (single group-by over all rows), returns (terms, frequencies) arrays.'''
+        store = TermFrequencyStore.load(store_path)
+        frequency = np.bincount(store['term_id'], weights=store['count'], minlength=len(store['terms'])).astype(np.int64)
+        return np.asarray(store['terms'], dtype=str), frequency
+
+
+
+###############
+#Plot rendering
+###############
+
+class PlotRenderer():
+    '''
+    Renders wordcloud and term frequency plots of documents in background processes from precomputed term frequencies,
+    so that preprocessing and corpus building do not wait for images. 
+    Existing images are skipped - repeated run only renders plots missing after an interrupted run.
+    workers=0 renders plots in the calling process.
+    '''
+    def __init__(self, image_path:str, wordclouds:bool=False, tf_plots:bool=False, workers:int=1, max_pending:int=plot_queue_size):
+        self.image_path = image_path
+        self.wordclouds = wordclouds
+        self.tf_plots = tf_plots
+        self.max_pending = max_pending
+        os.makedirs(image_path, exist_ok=True)
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=PlotRenderer.init_worker)
+        else:
+            PlotRenderer.init_worker()
+            self._executor = None
+        self._pending = deque()
+        self.stats = {'rendered':0, 'skipped':0, 'failed':0}
+
+
+    @staticmethod
+    def init_worker() -> None:
+        '''Selects non-interactive matplotlib backend.'''
+        import matplotlib
+        matplotlib.use('Agg')
+
+
+    @staticmethod
+    def render(kind:str, frequencies:dict, file_name:str) -> None:
+        '''Renders single plot, kind - 'wordcloud' or 'tfplot'.'''
+        if kind == 'wordcloud':
+            PreProcessor.plot_wordcloud(file_name=file_name, frequencies=frequencies)
+        else:
+            #term frequencies are aggregated from TermFrequencyStore - no per-document csv files
+            PreProcessor.plot_tfplot(file_name=file_name, frequencies=frequencies, save_pdf=False)
+
+
+    def submit(self, name:str, pdf_list:list, n:int) -> None:
+        '''Schedules plot of document n-grams (wordcloud takes precedence over term frequency plot, as in preprocess_document).'''
+        if not (self.wordclouds or self.tf_plots):
+            return
+        fname = str(os.path.basename(name).replace('.pdf',''))
+        file_name = os.path.join(self.image_path, fname) + f'{n}.png'
+        if os.path.isfile(file_name):
+            self.stats['skipped'] += 1
+            return
+        kind = 'wordcloud' if self.wordclouds else 'tfplot'
+        if self._executor is None:
+            PlotRenderer.render(kind, Counter(pdf_list), file_name)
+            self.stats['rendered'] += 1
+            return
+        self._pending.append((file_name, self._executor.submit(PlotRenderer.render, kind, Counter(pdf_list), file_name)))
+        #completed plots are collected, the oldest one is awaited only if too many plots are queued
+        while self._pending and (self._pending[0][1].done() or len(self._pending) > self.max_pending):
+            self._collect(*self._pending.popleft())
+
+
+    def _collect(self, file_name:str, future) -> None:
+        try:
+            future.result()
+            self.stats['rendered'] += 1
+        except Exception as e:
+            self.stats['failed'] += 1
+            logging.error(f'Failed to render {file_name} - {e}')
+
+
+    def render_documents(self, pdf_gen, n_gram_values:list):
+        '''Generator wrapper - schedules plots of each preprocessed document and passes the document on without waiting.'''
+        for doc in pdf_gen:
+            result = doc['result']
+            for n in n_gram_values:
+                self.submit(doc['name'], result[n] if isinstance(result, dict) else result, n)
+            yield doc
+
+
+    def close(self) -> dict:
+        '''Waits for queued plots, returns rendering statistics.'''
+        while self._pending:
+            self._collect(*self._pending.popleft())
+        if self._executor is not None:
+            self._executor.shutdown()
+        logging.info(f"Plots rendered: {self.stats['rendered']}, skipped (already exist): {self.stats['skipped']}, failed: {self.stats['failed']}")
+        return self.stats
@@ -0,0 +1,469 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+import itertools
+import pickle
+import random
+
+from glob import glob
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from modules.input_parsing import TextParser, DownloadEngine, ExternalLibConnector
+from modules.pipeline import AsyncPipeline
+from modules.preprocessing import CorpusManifest, PreProcessor, TokenCache, TokenCorpus
+
+
+def slow_pdf_reader(path):
+    '''Stand-in for PdfReader that takes longer than extraction timeout.'''
+    time.sleep(3)
+    raise AssertionError('extraction should have been interrupted')
+
+
+class FakePdfReader():
+    '''Stand-in for PdfReader with single page holding the file name.'''
+    def __init__(self, path):
+        self.pages = [mock.Mock(extract_text=mock.Mock(return_value=os.path.basename(path)))]
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    '''Thread pool used instead of process pool to count submitted tasks.'''
+    submitted = 0
+
+    def submit(self, *args, **kwargs):
+        CountingExecutor.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+class PdfRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Local stand-in for publication hosts - /flaky.pdf fails with 503 and /drop.pdf drops connection in the middle of the body 
+    on the first request, /missing.pdf is not found, other paths return a small pdf file.
+    '''
+    protocol_version = 'HTTP/1.1'
+    requests_seen = []
+    body = b'%PDF-1.4\n%%EOF\n'
+
+    def do_GET(self):
+        first = self.path not in PdfRequestHandler.requests_seen
+        PdfRequestHandler.requests_seen.append(self.path)
+        if self.path == '/missing.pdf':
+            self.send_error(404)
+        elif self.path == '/flaky.pdf' and first:
+            self.send_error(503)
+        elif self.path == '/drop.pdf' and first:
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(b'100\r\n%PDF-')
+            self.close_connection = True
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(PdfRequestHandler.body)))
+            self.end_headers()
+            self.wfile.write(PdfRequestHandler.body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+###################
+#Parsing text files
+###################
+
+class TestTextParser(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(self.folder, 'slow.pdf')
+        with open(self.pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n%%EOF\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_timeout_keeps_file(self):
+        with mock.patch('modules.input_parsing.PdfReader', slow_pdf_reader):
+            self.assertIsNone(TextParser.read_pdf_with_timeout(self.pdf_path, timeout=1))
+        self.assertTrue(os.path.isfile(self.pdf_path))
+
+
+    def test_timeout_in_process_pool_keeps_file(self):
+        with mock.patch('modules.input_parsing.PdfReader', slow_pdf_reader):
+            docs = list(TextParser.pdf_generator(self.folder, workers=2, timeout=1))
+        self.assertEqual(docs, [])
+        self.assertTrue(os.path.isfile(self.pdf_path))
+
+
+    def test_pool_keeps_bounded_number_of_files_in_flight(self):
+        for i in range(20):
+            shutil.copy(self.pdf_path, os.path.join(self.folder, f'doc{i}.pdf'))
+        expected = [os.path.basename(path) for path in glob(os.path.join(self.folder, '*.pdf'))]
+        for ordered in [True, False]:
+            CountingExecutor.submitted = 0
+            with mock.patch('modules.input_parsing.PdfReader', FakePdfReader), mock.patch('modules.input_parsing.ProcessPoolExecutor', CountingExecutor):
+                docs = TextParser.pdf_generator(self.folder, workers=2, ordered=ordered)
+                names = [next(docs)['text'][0]]
+                #two files per worker plus the one submitted before the first result is yielded
+                self.assertLessEqual(CountingExecutor.submitted, 5)
+                names.extend(doc['text'][0] for doc in docs)
+            self.assertEqual(names if ordered else sorted(names), expected if ordered else sorted(expected))
+
+
+    def test_skipped_files_keep_their_position(self):
+        for i in range(6):
+            shutil.copy(self.pdf_path, os.path.join(self.folder, f'doc{i}.pdf'))
+        paths = glob(os.path.join(self.folder, '*.pdf'))
+        skip = lambda path: path == paths[3]
+        for workers in [1, 2]:
+            with mock.patch('modules.input_parsing.PdfReader', FakePdfReader), mock.patch('modules.input_parsing.ProcessPoolExecutor', CountingExecutor):
+                docs = list(TextParser.pdf_generator(self.folder, workers=workers, skip=skip))
+            self.assertEqual([doc['name'] for doc in docs], paths)
+            self.assertIsNone(docs[3]['text'])
+
+
+    def test_corrupted_file_is_removed(self):
+        with mock.patch('modules.input_parsing.PdfReader', side_effect=ValueError('broken file')):
+            self.assertIsNone(TextParser.read_pdf(self.pdf_path))
+        self.assertFalse(os.path.isfile(self.pdf_path))
+
+
+###############
+#Pre-processing
+###############
+
+def split_pages(pdf_dict, **kwargs):
+    '''Stand-in for PreProcessor.clean_document that only splits pages into tokens.'''
+    return {page:text.split() for page, text in pdf_dict.items()}
+
+
+WORDS = ['genome', 'assembly', 'read', 'alignment', 'variant', 'protein', 'model', 'topic', 'corpus', 'sequence']
+
+
+def random_documents(num_docs:int=12, seed:int=0) -> list:
+    '''Documents of random words (with repetitions), keyed by file name and split into pages.'''
+    rng = random.Random(seed)
+    return [
+        {'name':f'doc{i}.pdf', 'text':{page:' '.join(rng.choices(WORDS, k=rng.randint(0, 200))) for page in range(rng.randint(1, 3))}}
+        for i in range(num_docs)
+        ]
+
+
+class TestPreProcessor(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        docs = random_documents()
+        self.docs = [PreProcessor.flatten_pages(split_pages(doc['text'])) for doc in docs]
+        self.names = [doc['name'] for doc in docs]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def cooc_lines(self, docs, engine:str) -> list:
+        vocab = PreProcessor.gen_vocab(docs)
+        vocab_path, cooc_path = os.path.join(self.folder, f'vocab_{engine}.txt'), os.path.join(self.folder, f'cooc_{engine}.txt')
+        PreProcessor.get_cooc_vocab(docs, vocab, vocab_path=vocab_path, cooc_path=cooc_path, window=3, engine=engine)
+        with open(vocab_path, 'r') as f:
+            vocab_lines = f.readlines()
+        with open(cooc_path, 'r') as f:
+            return vocab_lines, sorted(f.readlines())
+
+
+    def test_sparse_cooc_matches_python_engine(self):
+        corpus = TokenCorpus()
+        for name, doc in zip(self.names, self.docs):
+            corpus.add(name, doc)
+        expected = self.cooc_lines(self.docs, engine='python')
+        self.assertTrue(expected[1])
+        self.assertEqual(self.cooc_lines(self.docs, engine='sparse'), expected)
+        self.assertEqual(self.cooc_lines(corpus, engine='sparse'), expected)
+
+
+    def test_process_pool_matches_serial_preprocessing(self):
+        kwargs = {'output_path':self.folder, 'n_gram_value':[1, 2], 'lower_fth':0, 'upper_fth':100}
+        with mock.patch('modules.preprocessing.PreProcessor.clean_document', split_pages), \
+             mock.patch('modules.preprocessing.PreProcessor.init_worker'), \
+             mock.patch('modules.preprocessing.ProcessPoolExecutor', ThreadPoolExecutor):
+            serial = list(PreProcessor.preprocess_generator(iter(random_documents()), workers=1, **kwargs))
+            pooled = list(PreProcessor.preprocess_generator(iter(random_documents()), workers=2, **kwargs))
+        self.assertEqual(pooled, serial)
+        self.assertEqual([doc['name'] for doc in pooled], self.names)
+
+
+##############
+#Token caching
+##############
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(self.folder, 'doc.pdf')
+        with open(self.pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n%%EOF\n')
+        #stopword list is only used in the cache fingerprint - nltk data is not needed
+        with mock.patch('modules.preprocessing.PreProcessor.get_stop_words', return_value=set()):
+            self.cache = TokenCache(os.path.join(self.folder, 'cache'), ext_stopword_list=[])
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_cached_tokens_are_loaded(self):
+        self.cache.put(self.pdf_path, {0:['genome', 'assembly']})
+        with mock.patch('modules.preprocessing.TextParser.read_pdf') as read_pdf:
+            result = PreProcessor.preprocess_document(None, self.pdf_path, image_path=self.folder, token_cache=self.cache)
+        read_pdf.assert_not_called()
+        self.assertEqual(result, ['genome', 'assembly'])
+
+
+    def test_missing_entry_is_extracted_again(self):
+        pdf = {'name':self.pdf_path, 'text':{0:'genome assembly'}}
+        with mock.patch('modules.preprocessing.TextParser.read_pdf', return_value=pdf), \
+             mock.patch('modules.preprocessing.PreProcessor.clean_document', split_pages):
+            result = PreProcessor.preprocess_document(None, self.pdf_path, image_path=self.folder, token_cache=self.cache)
+        self.assertEqual(result, ['genome', 'assembly'])
+        self.assertTrue(self.cache.contains(self.pdf_path))
+
+
+    def test_key_memo_is_not_pickled(self):
+        self.cache.contains(self.pdf_path)
+        restored = pickle.loads(pickle.dumps(self.cache))
+        self.assertEqual(restored._keys, {})
+        self.assertEqual(restored.key(self.pdf_path), self.cache.key(self.pdf_path))
+
+
+############################
+#Incremental corpus updates
+############################
+
+class TestCorpusManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(self.folder, 'doc.pdf')
+        with open(self.pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n%%EOF\n')
+        self.state_path = os.path.join(self.folder, '.incremental', 'model')
+        os.makedirs(self.state_path)
+        with open(os.path.join(self.state_path, 'index.json'), 'w') as f:
+            f.write('{}')
+        manifest = CorpusManifest(self.folder, settings={'file_names':['model']}, state_paths=[self.state_path])
+        manifest.diff([self.pdf_path])
+        manifest.update(added=['doc.pdf'], retracted=[])
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_unchanged_files_are_skipped(self):
+        manifest = CorpusManifest(self.folder, settings={'file_names':['model']}, state_paths=[self.state_path])
+        self.assertFalse(manifest.reset)
+        self.assertEqual(manifest.diff([self.pdf_path]), ([], []))
+
+
+    def test_other_model_name_rebuilds_corpus(self):
+        other_state_path = os.path.join(self.folder, '.incremental', 'other')
+        manifest = CorpusManifest(self.folder, settings={'file_names':['other']}, state_paths=[other_state_path])
+        self.assertTrue(manifest.reset)
+        self.assertEqual(manifest.diff([self.pdf_path]), ([self.pdf_path], []))
+
+
+    def test_missing_state_rebuilds_corpus(self):
+        shutil.rmtree(self.state_path)
+        manifest = CorpusManifest(self.folder, settings={'file_names':['model']}, state_paths=[self.state_path])
+        self.assertTrue(manifest.reset)
+        self.assertEqual(manifest.diff([self.pdf_path]), ([self.pdf_path], []))
+
+
+##################
+#Download engine
+##################
+
+class TestDownloadEngine(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), PdfRequestHandler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.engine = DownloadEngine(retries=2, backoff=0)
+        PdfRequestHandler.requests_seen = []
+
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.folder)
+
+
+    def download(self, name:str, filters:list=[]) -> str:
+        return ExternalLibConnector.download_file(f'{self.url}/{name}', name, self.folder, self.engine, filters=filters)
+
+
+    def test_retryable_status_is_retried(self):
+        self.assertEqual(self.download('flaky.pdf'), os.path.join(self.folder, 'flaky.pdf'))
+        self.assertEqual(PdfRequestHandler.requests_seen, ['/flaky.pdf', '/flaky.pdf'])
+        self.assertEqual(self.engine.stats['succeeded'], 1)
+        self.assertEqual(self.engine.stats['bytes'], len(PdfRequestHandler.body))
+
+
+    def test_dropped_connection_is_retried(self):
+        self.assertEqual(self.download('drop.pdf'), os.path.join(self.folder, 'drop.pdf'))
+        self.assertEqual(PdfRequestHandler.requests_seen, ['/drop.pdf', '/drop.pdf'])
+        with open(os.path.join(self.folder, 'drop.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), PdfRequestHandler.body)
+
+
+    def test_missing_file_fails_without_retries(self):
+        self.assertIsNone(self.download('missing.pdf'))
+        self.assertEqual(PdfRequestHandler.requests_seen, ['/missing.pdf'])
+        self.assertEqual((self.engine.stats['succeeded'], self.engine.stats['failed']), (0, 1))
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+    def test_unreachable_host_is_recorded_as_failed(self):
+        self.assertFalse(self.engine.fetch('http://127.0.0.1:1/doc.pdf', os.path.join(self.folder, 'doc.pdf')))
+        self.assertEqual(self.engine.stats['failed'], 1)
+
+
+    def test_filtered_host_is_skipped(self):
+        self.assertIsNone(self.download('doc.pdf', filters=['127.0.0.1']))
+        self.assertEqual(PdfRequestHandler.requests_seen, [])
+        self.assertEqual(self.engine.stats['skipped'], 1)
+
+
+##################
+#Zotero item cache
+##################
+
+class StubZotero():
+    '''Stand-in for pyzotero client serving items of single collection, requested item keys are recorded in pages.'''
+    def __init__(self):
+        self.library = {key:{'key':key, 'version':1, 'data':{'title':key}} for key in ['A', 'B', 'C']}
+        self.members = {'COL':['A', 'B', 'C']}
+        self.pages = []
+
+
+    def collection_items(self, collection_id, format=None, limit=None):
+        return {key:self.library[key]['version'] for key in self.members[collection_id]}
+
+
+    def items(self, itemKey='', limit=None):
+        keys = itemKey.split(',')
+        self.pages.append(keys)
+        return [self.library[key] for key in keys]
+
+
+class TestZoteroItemCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.folder, 'zotero_items.sqlite')
+        self.zot = StubZotero()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def sync(self) -> dict:
+        items = ExternalLibConnector.get_items_zotero(self.zot, {'Collection':'COL'}, max_workers=2, cache_path=self.cache_path, page_size=2)
+        return {item['key']:item for item in items}
+
+
+    def test_resync_fetches_only_changed_items(self):
+        self.assertEqual(sorted(self.sync()), ['A', 'B', 'C'])
+        self.assertEqual(sorted(map(len, self.zot.pages)), [1, 2])
+        self.assertEqual(sorted(itertools.chain.from_iterable(self.zot.pages)), ['A', 'B', 'C'])
+
+        self.zot.pages = []
+        self.zot.library['B'] = {'key':'B', 'version':2, 'data':{'title':'B changed'}}
+        self.zot.members['COL'].remove('C')
+        items = self.sync()
+        self.assertEqual(self.zot.pages, [['B']])
+        self.assertEqual(sorted(items), ['A', 'B'])
+        self.assertEqual(items['B']['data']['title'], 'B changed')
+
+
+##############################
+#Overlapping download pipeline
+##############################
+
+def fake_download_file(url, name, save_path, engine, filters, force_run):
+    '''Stand-in for ExternalLibConnector.download_file - download of bad.pdf is interrupted.'''
+    if name == 'bad.pdf':
+        raise OSError('connection dropped')
+    path = os.path.join(save_path, name)
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n%%EOF\n')
+    engine.record('succeeded')
+    return path
+
+
+class TestAsyncPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_failed_download_does_not_abort_pipeline(self):
+        engine = DownloadEngine()
+        pipeline = AsyncPipeline(
+            save_path=self.folder, 
+            name_url_dict={'bad.pdf':'http://localhost/bad.pdf', 'good.pdf':'http://localhost/good.pdf'}, 
+            engine=engine
+            )
+        with mock.patch('modules.pipeline.ExternalLibConnector.download_file', fake_download_file), \
+             mock.patch('modules.pipeline.TextParser.read_pdf_with_timeout', lambda path, timeout: {'name':path, 'text':{0:'text'}}), \
+             mock.patch('modules.pipeline.PreProcessor') as preprocessor, \
+             mock.patch('modules.pipeline.ProcessPoolExecutor', ThreadPoolExecutor):
+            preprocessor.preprocess_document.return_value = ['text']
+            docs = list(pipeline.generator())
+        self.assertEqual([os.path.basename(doc['name']) for doc in docs], ['good.pdf'])
+        self.assertEqual((engine.stats['succeeded'], engine.stats['failed']), (1, 1))
+
+
+    def test_skip_check_runs_outside_event_loop(self):
+        threads = []
+        def skip(path):
+            threads.append(threading.current_thread())
+            return True
+        pipeline = AsyncPipeline(save_path=self.folder, name_url_dict={'good.pdf':'http://localhost/good.pdf'}, engine=DownloadEngine(), skip=skip)
+        with mock.patch('modules.pipeline.ExternalLibConnector.download_file', fake_download_file), \
+             mock.patch('modules.pipeline.PreProcessor') as preprocessor, \
+             mock.patch('modules.pipeline.ProcessPoolExecutor', ThreadPoolExecutor):
+            preprocessor.preprocess_document.return_value = ['text']
+            docs = list(pipeline.generator())
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(len(threads), 1)
+        #event loop runs in the thread started by generator, blocking calls in default executor threads
+        self.assertTrue(threads[0].name.startswith('asyncio'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+'''
+Small helpers shared by modules - kept free of heavy imports.
+'''
+import hashlib
+
+
+########
+#Hashing
+########
+
+def file_hash(path:str, digest=None) -> str:
+    '''
+    sha256 hex digest of file content, read in chunks.
+    digest - hashlib object already updated with a prefix (e.g. configuration fingerprint), new sha256 is used otherwise.
+    '''
+    digest = digest if digest is not None else hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()